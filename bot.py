@@ -1,13 +1,18 @@
 import logging
+import secrets
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from config import BOT_TOKEN, MESSAGES, BUTTONS, FILES
+from config import BOT_TOKEN, ADMIN_IDS, MESSAGES, BUTTONS, FILES, KEYWORD_MATCHING, PREWARM, UPDATES, RATE_LIMITS
 # from handlers.extendedUseRequest import ExtendedUseRequestHandler
 from handlers.calculation_handler import CalculationHandler
 # from handlers.strategic_handler import StrategicHandler
 # from handlers.materials_handler import MaterialsHandler
 from handlers.data_collection_handler import DataCollectionHandler
 from handlers.keyword_handler import KeywordHandler
+from handlers.broadcast_handler import BroadcastHandler
+from keyword_analytics import KeywordAnalytics
+from update_processor import PerUserUpdateProcessor
+from rate_limiter import PriorityRateLimiter, PRIORITY_NAMES
 
 # Configure logging
 logging.basicConfig(
@@ -18,21 +23,45 @@ logger = logging.getLogger(__name__)
 
 class TripwireBot:
     def __init__(self):
-        self.application = Application.builder().token(BOT_TOKEN).build()
+        self.rate_limiter = PriorityRateLimiter(RATE_LIMITS)
+        self.application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            # A slow send for one user does not hold up the others
+            .concurrent_updates(PerUserUpdateProcessor(UPDATES["concurrent_updates"]))
+            # Every outgoing request waits for Telegram's flood limits, button replies first
+            .rate_limiter(self.rate_limiter)
+            .post_init(self.post_init)
+            .post_stop(self.post_stop)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
         
         # Initialize handlers
         from pdf_handler import PDFHandler
         from data_manager import UserDataManager
         
         pdf_handler = PDFHandler()
+        # Documents are looked up in memory, the catalog follows changes on disk
+        pdf_handler.start_watching()
         data_manager = UserDataManager()
+        # Pick up external edits of the user data (e.g. manual deletions) off the update path
+        data_manager.start_watching()
+        self.data_manager = data_manager
+        self.pdf_handler = pdf_handler
         
         # self.extended_use_handler = ExtendedUseRequestHandler(pdf_handler)
         self.calculation_handler = CalculationHandler(pdf_handler)
         # self.strategic_handler = StrategicHandler(pdf_handler)
         # self.materials_handler = MaterialsHandler(pdf_handler)
         self.data_collection_handler = DataCollectionHandler(data_manager)
-        self.keyword_handler = KeywordHandler()
+        self.broadcast_handler = BroadcastHandler(data_manager)
+        # Keyword hits and document sends, written to disk in the background
+        self.keyword_analytics = KeywordAnalytics(FILES["keyword_stats"], KEYWORD_MATCHING["stats_flush_interval"])
+        self.keyword_analytics.start()
+        self.keyword_handler = KeywordHandler(pdf_handler, self.keyword_analytics)
+        # Keyword changes are compiled off the update path and swapped in when ready
+        self.keyword_handler.start_watching()
         
         self.setup_handlers()
     
@@ -43,6 +72,13 @@ class TripwireBot:
         self.application.add_handler(CommandHandler("help", self.help_command))
         self.application.add_handler(CommandHandler("docs", self.docs_command))
         
+        # Admin commands - ignored for everyone not listed in ADMIN_IDS
+        admin_filter = filters.User(user_id=ADMIN_IDS)
+        self.application.add_handler(CommandHandler("stats", self.stats_command, filters=admin_filter))
+        self.application.add_handler(CommandHandler("keywordstats", self.keyword_stats_command, filters=admin_filter))
+        self.application.add_handler(CommandHandler("sendstats", self.send_stats_command, filters=admin_filter))
+        self.application.add_handler(CommandHandler("broadcast", self.broadcast_handler.broadcast_command, filters=admin_filter))
+        
         # Callback query handler for button clicks
         self.application.add_handler(CallbackQueryHandler(self.button_callback))
         
@@ -55,9 +91,8 @@ class TripwireBot:
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         user = update.effective_user
-        
-        # Auto-reload data if file has been modified
-        self.data_collection_handler.data_manager.check_and_reload()
+        # Back after blocking the bot - include in broadcasts again
+        self.broadcast_handler.forget_blocked(user.id)
         
         # Check if user has already given consent
         if self.data_collection_handler.data_manager.user_has_consent(user.id):
@@ -86,14 +121,50 @@ class TripwireBot:
         reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text(MESSAGES["docs"], reply_markup=reply_markup)
     
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /stats admin command"""
+        stats = self.data_manager.get_stats()
+        # Most recent days only, the full history can be long
+        recent_days = list(stats["signups_by_day"].items())[-14:]
+        signups = "\n".join(f"{day}: {count}" for day, count in recent_days) or "—"
+        await update.message.reply_text(MESSAGES["stats"].format(signups=signups, **stats))
+    
+    async def keyword_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /keywordstats admin command"""
+        counters = self.keyword_analytics.snapshot()
+        miss_rate = (counters.misses / counters.messages * 100) if counters.messages > 0 else 0
+        keywords = "\n".join(f"{keyword}: {count}" for keyword, count in counters.keywords.most_common(15)) or "—"
+        documents = "\n".join(
+            f"{filename}: {stats.sent} / {stats.failed} / {stats.average_ms():.0f} / "
+            f"{stats.percentile_ms(0.95):.0f} / {stats.max_ms:.0f}"
+            for filename, stats in sorted(counters.documents.items(), key=lambda item: -item[1].sent)
+        ) or "—"
+        await update.message.reply_text(MESSAGES["keyword_stats"].format(
+            messages=counters.messages,
+            misses=counters.misses,
+            miss_rate=miss_rate,
+            keywords=keywords,
+            documents=documents
+        ))
+    
+    async def send_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /sendstats admin command"""
+        queued = ", ".join(f"{name}: {count}" for name, count in self.rate_limiter.queue_depth().items())
+        waits = "\n".join(
+            f"{name}: {stats.count} / {stats.average_ms():.0f} / {stats.percentile_ms(0.95):.0f} / {stats.max_ms:.0f}"
+            for name, stats in zip(PRIORITY_NAMES, self.rate_limiter.waits)
+        )
+        await update.message.reply_text(MESSAGES["send_stats"].format(
+            queued=queued,
+            waits=waits,
+            retry_after=self.rate_limiter.retry_after
+        ))
+    
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle button callbacks"""
         query = update.callback_query
         await query.answer()  # Answer the callback query
         
-        # Auto-reload data if file has been modified
-        self.data_collection_handler.data_manager.check_and_reload()
-        
         # Check if user has consent (except for consent-related buttons)
         consent_buttons = ["consent_yes", "consent_no"]
         if query.data not in consent_buttons:
@@ -148,9 +219,6 @@ class TripwireBot:
         """Handle back to start - show main menu"""
         user = query.from_user
         
-        # Auto-reload data if file has been modified
-        self.data_collection_handler.data_manager.check_and_reload()
-        
         # Check if user has consent
         if not self.data_collection_handler.data_manager.user_has_consent(user.id):
             # User doesn't have consent - redirect to consent flow
@@ -197,15 +265,14 @@ class TripwireBot:
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            with open(FILES["brief"], "rb") as file:
-                await context.bot.send_document(
-                    chat_id=query.from_user.id,
-                    document=file,
-                    filename=FILES["brief"],
-                    caption=MESSAGES["brief_caption"],
-                    reply_markup=reply_markup
-                )
-            
+            await self.pdf_handler.file_id_cache.send_document(
+                context.bot,
+                query.from_user.id,
+                FILES["brief"],
+                caption=MESSAGES["brief_caption"],
+                reply_markup=reply_markup
+            )
+        
         except FileNotFoundError:
             keyboard = [
                 [InlineKeyboardButton(BUTTONS["back"], callback_data="calculation")],
@@ -233,9 +300,6 @@ class TripwireBot:
     
     async def handle_text_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text messages and check for keywords"""
-        # Auto-reload data if file has been modified
-        self.data_collection_handler.data_manager.check_and_reload()
-        
         # Check if user has consent
         if not self.data_collection_handler.data_manager.user_has_consent(update.message.from_user.id):
             # User doesn't have consent - redirect to consent flow
@@ -251,10 +315,55 @@ class TripwireBot:
             # await update.message.reply_text("Я не нашел ключевых слов в вашем сообщении. Попробуйте использовать слова: аудит, процессы, продукт, файл")
             pass
     
+    async def post_init(self, application: Application):
+        """Upload documents to the pre-warm chat before serving updates (if configured)"""
+        if PREWARM["chat_id"] is not None:
+            await self.pdf_handler.prewarm(application.bot, PREWARM["chat_id"], PREWARM["concurrency"])
+        # A broadcast interrupted by a restart continues where it stopped
+        self.broadcast_handler.resume(application.bot)
+    
+    async def post_stop(self, application: Application):
+        """Stop a running broadcast while the bot can still send (it resumes on the next start)"""
+        await self.broadcast_handler.stop()
+    
+    async def post_shutdown(self, application: Application):
+        """Write pending user data before the process exits"""
+        self.keyword_handler.stop_watching()
+        self.pdf_handler.stop_watching()
+        self.keyword_analytics.stop()
+        self.data_manager.close()
+        logger.info("User data flushed")
+    
     def run(self):
         """Start the bot"""
-        logger.info("Starting TripwireBot...")
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        logger.info(f"Starting TripwireBot ({UPDATES['mode']} mode)...")
+        if UPDATES["mode"] == "polling":
+            self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        elif UPDATES["mode"] == "webhook":
+            self.run_webhook()
+        else:
+            raise ValueError(f"Unknown update mode: {UPDATES['mode']}")
+    
+    def run_webhook(self):
+        """Receive updates on an embedded HTTP server that Telegram posts them to
+
+        The webhook is registered with Telegram on start. Requests without
+        the secret token header are rejected by the server.
+        """
+        if not UPDATES["webhook_url"]:
+            raise ValueError("WEBHOOK_URL environment variable is required in webhook mode")
+        # A random secret works too, the webhook is registered again on every start
+        secret_token = UPDATES["secret_token"] or secrets.token_urlsafe(32)
+        path = UPDATES["path"].strip("/")
+        self.application.run_webhook(
+            listen=UPDATES["listen"],
+            port=UPDATES["port"],
+            url_path=path,
+            webhook_url=f"{UPDATES['webhook_url'].rstrip('/')}/{path}",
+            secret_token=secret_token,
+            max_connections=UPDATES["max_connections"],
+            allowed_updates=Update.ALL_TYPES
+        )
 
 if __name__ == "__main__":
     bot = TripwireBot()
@@ -27,6 +27,32 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN environment variable is required. Please set it in your .env file")
 
+# Telegram user IDs allowed to use admin commands, comma separated in .env (ADMIN_IDS=123,456)
+ADMIN_IDS = [int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()]
+
+# How updates are received, BOT_MODE and WEBHOOK_* in .env
+UPDATES = {
+    "mode": os.getenv('BOT_MODE', 'polling'),       # "polling" - long polling getUpdates, "webhook" - Telegram pushes updates over HTTPS
+    "webhook_url": os.getenv('WEBHOOK_URL'),        # "webhook" mode: public HTTPS URL, e.g. https://bot.example.com (path is appended)
+    "listen": os.getenv('WEBHOOK_LISTEN', '127.0.0.1'),  # Address the embedded HTTP server binds (behind a TLS reverse proxy)
+    "port": int(os.getenv('WEBHOOK_PORT', '8080')), # Port the embedded HTTP server listens on
+    "path": os.getenv('WEBHOOK_PATH', 'telegram'),  # URL path of the webhook endpoint
+    "secret_token": os.getenv('WEBHOOK_SECRET'),    # Required X-Telegram-Bot-Api-Secret-Token header, random per start if unset
+    "max_connections": 40,                          # Simultaneous HTTPS connections Telegram may open (1-100)
+    "concurrent_updates": 64                        # Updates of different users processed at once, one user's always in order
+}
+
+# Outgoing Bot API request limits (token buckets: rate per second, burst = bucket size)
+RATE_LIMITS = {
+    "global_rate": 25,              # Requests per second across all chats (with the burst at most 30 in any second)
+    "global_burst": 5,
+    "chat_rate": 1.0,               # Requests per second to one private chat
+    "chat_burst": 3,
+    "group_rate": 20 / 60,          # Requests per second to one group (20 per minute)
+    "group_burst": 3,
+    "max_retries": 3                # Retries of a request after a 429 RetryAfter
+}
+
 # Bot identity settings
 BOT_NAME = "TripwireBot"
 BOT_USERNAME = "tripwire_bot"  # Change this to your bot's username
@@ -37,6 +63,9 @@ BOT_USERNAME = "tripwire_bot"  # Change this to your bot's username
 
 # Maps user keywords to PDF files for automatic responses
 # Format: "keyword": "filename.pdf"
+# Used when FILES["keywords"] does not exist. That file holds the same mapping
+# as a JSON object and is reloaded without a restart whenever it changes.
+# In "stem" matching mode every form of a word matches, listing one is enough
 KEYWORD_PDF_MAPPING = {
     # Russian keywords
     "аудит": "audit_processes.pdf",
@@ -54,6 +83,16 @@ KEYWORD_PDF_MAPPING = {
     "file": "frst_file.pdf"
 }
 
+KEYWORD_MATCHING = {
+    "mode": "stem",                 # "stem" - whole words compared by stem (any word form),
+                                    # "substring" - keyword anywhere in the message text
+    "fuzzy": False,                 # "stem" mode: also match misspelled words ("процесы" -> "процессы")
+    "fuzzy_max_distance": 2,        # Most typos (edit distance) tolerated in one word
+    "fuzzy_chars_per_typo": 6,      # One typo allowed per this many letters, shorter words match exactly
+    "watch_interval": 1.0,          # Seconds between checks of FILES["keywords"] when inotify is unavailable
+    "stats_flush_interval": 60.0    # Seconds between writes of keyword counters to FILES["keyword_stats"]
+}
+
 # =============================================================================
 # BOT MESSAGES
 # =============================================================================
@@ -72,6 +111,40 @@ MESSAGES = {
     "brief_not_found": "❌ Файл бриф не найден. Обратитесь к администратору.",
     "file_error": "❌ Ошибка при отправке файла: {}",
     
+    # Admin commands
+    "stats": """📊 Статистика
+
+Всего пользователей: {total_users}
+С согласием: {users_with_consent} ({consent_rate:.1f}%)
+
+Регистрации по дням:
+{signups}""",
+    
+    "keyword_stats": """🔑 Ключевые слова
+
+Сообщений: {messages}, без совпадений: {misses} ({miss_rate:.1f}%)
+
+Частые ключевые слова:
+{keywords}
+
+Документы (отправлено / ошибок / среднее / p95 / макс., мс):
+{documents}""",
+    
+    "broadcast_usage": "Использование: /broadcast <текст сообщения> — отправить всем пользователям с согласием, /broadcast — прогресс рассылки",
+    "broadcast_started": "📣 Рассылка запущена: {total} получателей",
+    "broadcast_busy": "⏳ Рассылка уже идёт, прогресс: /broadcast",
+    "broadcast_status": "📣 Рассылка: {done} из {total} ({minutes:.0f} мин.)\nОтправлено: {sent}, заблокировали бота: {blocked}, ошибок: {failed}",
+    "broadcast_finished": "✅ Рассылка завершена за {minutes:.0f} мин.\nОтправлено: {sent}, заблокировали бота: {blocked}, ошибок: {failed}",
+    
+    "send_stats": """📤 Исходящие запросы
+
+В очереди: {queued}
+
+Ожидание (запросов / среднее / p95 / макс., мс):
+{waits}
+
+Ответов 429 (RetryAfter): {retry_after}""",
+    
     # Feature explanations
     "useful_files": """📁 Полезные файлы
 
@@ -135,5 +208,59 @@ BUTTONS = {
 # Important file paths used by the bot
 FILES = {
     "brief": "RED.brief.odt",      # Brief file for calculations
-    "user_data": "user_data.json"  # User data storage file
-} 
\ No newline at end of file
+    "user_data": "user_data.json", # User data storage file
+    "user_db": "user_data.db",     # User data database (STORAGE["mode"] = "sqlite")
+    "user_shards": "user_data_shards", # User data shard directory (STORAGE["mode"] = "sharded")
+    "keywords": "keywords.json",   # Keyword -> PDF mapping, replaces KEYWORD_PDF_MAPPING, reloaded on change
+    "keyword_stats": "keyword_stats.json", # Keyword hit and document send counters (/keywordstats)
+    "file_ids": "file_ids.json",   # Telegram file_ids of uploaded documents, reused instead of uploading again
+    "broadcast": "broadcast.json", # Progress of the running /broadcast, resumed after a restart
+    "blocked_users": "blocked_users.txt" # Users who blocked the bot or deleted their account, skipped by /broadcast
+}
+
+# =============================================================================
+# STORAGE CONFIGURATION
+# =============================================================================
+
+# User data storage settings
+STORAGE = {
+    "mode": "journal",              # "json" - rewrite the whole file after each burst of changes, "journal" - append-only log,
+                                    # "sqlite" - indexed database in FILES["user_db"],
+                                    # "sharded" - journaled shard files in FILES["user_shards"]
+    "journal": "user_data.journal", # Append-only log of changes on top of FILES["user_data"]
+    "compact_threshold": 1000,      # Journal entries before background compaction into the snapshot
+    "watch_interval": 1.0,          # Seconds between checks for external edits when inotify is unavailable
+    "flush_window": 0.5,            # "json" mode: seconds to collect changes before rewriting the file
+    "flush_max_dirty": 100,         # "json" mode: changed records that trigger an immediate rewrite
+    "shards": 64,                   # "sharded" mode: number of shard files (do not change for existing data)
+    "max_records_in_memory": 1000000, # "sharded" mode: records kept loaded before LRU shards are evicted
+    "busy_timeout": 30.0            # "sqlite" mode: seconds a write waits for other processes holding the database
+}
+
+# =============================================================================
+# DOCUMENT DELIVERY
+# =============================================================================
+
+# Bytes of documents kept in memory for uploads (used when no Telegram file_id is cached)
+DOCUMENT_CACHE = {
+    "max_bytes": 32 * 1024 * 1024,  # Total size of cached documents, least recently sent are dropped first
+    "max_file_size": 5 * 1024 * 1024  # Larger files are read from disk on every upload
+}
+
+# Upload of all documents at startup, so even the first request is sent by Telegram file_id
+PREWARM = {
+    # Chat receiving the uploads (e.g. a private channel with the bot), PREWARM_CHAT_ID in .env, unset to disable
+    "chat_id": int(os.getenv('PREWARM_CHAT_ID', '0')) or None,
+    "concurrency": 4                # Uploads running at the same time
+}
+
+# =============================================================================
+# BROADCAST CONFIGURATION
+# =============================================================================
+
+# /broadcast to all users with consent, paced by RATE_LIMITS at background priority
+BROADCAST = {
+    "concurrency": 30,              # Messages in flight at once (the rate limiter decides when they go)
+    "checkpoint_interval": 2.0,     # Seconds between writes of the progress to FILES["broadcast"]
+    "stop_timeout": 5.0             # Seconds messages in flight get to finish on shutdown
+}
@@ -1,63 +1,114 @@
-import json
-import os
+from array import array
+import asyncio
 from datetime import datetime
 import logging
-import time
-from config import FILES
+import threading
+import weakref
+from config import FILES, STORAGE
+from file_watcher import FileWatcher
+from storage.consent_index import ConsentIndex
+from storage.json_storage import JsonStorage
+from storage.sharded_storage import ShardedStorage
+from storage.sqlite_storage import SQLiteStorage
+from storage.user_stats import UserStats
 
 logger = logging.getLogger(__name__)
 
+def create_storage(mode=STORAGE["mode"]):
+    """Create the storage backend selected in config"""
+    if mode == "sqlite":
+        return SQLiteStorage(FILES["user_db"], busy_timeout=STORAGE["busy_timeout"])
+    if mode == "sharded":
+        return ShardedStorage(
+            FILES["user_shards"],
+            shards=STORAGE["shards"],
+            max_records_in_memory=STORAGE["max_records_in_memory"],
+            compact_threshold=STORAGE["compact_threshold"]
+        )
+    if mode in ("json", "journal"):
+        return JsonStorage(
+            FILES["user_data"],
+            mode=mode,
+            journal_filename=STORAGE["journal"],
+            compact_threshold=STORAGE["compact_threshold"],
+            flush_window=STORAGE["flush_window"],
+            flush_max_dirty=STORAGE["flush_max_dirty"]
+        )
+    raise ValueError(f"Unknown storage mode: {mode}")
+
 class UserDataManager:
-    """Manages user data storage in JSON format"""
+    """Manages user data storage
+
+    Records are kept by a storage backend (see the storage package)
+    selected with STORAGE["mode"] in config. Consent checks are answered
+    from an in-memory ConsentIndex and statistics from running UserStats
+    counters, both kept in sync with every change, so neither touches the
+    records themselves.
+    """
     
-    def __init__(self, filename=FILES["user_data"]):
-        self.filename = filename
-        self.last_modified_time = 0
+    def __init__(self, storage=None):
+        self.storage = storage or create_storage()
+        self.consent_index = ConsentIndex()
+        self.stats = UserStats()
+        self._index_lock = threading.Lock()
+        self._index_changes = None
+        self._user_locks = weakref.WeakValueDictionary()
+        self._watcher = None
         self.load_data()
     
     def load_data(self):
-        """Load existing data from JSON file"""
+        """Load existing data from storage"""
         try:
-            if os.path.exists(self.filename):
-                with open(self.filename, 'r', encoding='utf-8') as f:
-                    self.data = json.load(f)
-                self.last_modified_time = os.path.getmtime(self.filename)
-                logger.info(f"Loaded {len(self.data)} user records from {self.filename}")
-            else:
-                self.data = {}
-                self.last_modified_time = 0
-                logger.info(f"Created new data file: {self.filename}")
+            self.storage.load()
+            self._rebuild_indexes()
+            logger.info(f"Loaded {self.stats.total_users} user records from {self.storage.filename}")
         except Exception as e:
             logger.error(f"Error loading data: {e}")
-            self.data = {}
+    
+    def start_watching(self, poll_interval=STORAGE["watch_interval"]):
+        """Reload data in a background thread whenever storage files are edited externally"""
+        paths = self.storage.watched_files()
+        if not paths or self._watcher is not None:
+            return
+        self._watcher = FileWatcher(paths, self.check_and_reload, poll_interval=poll_interval, name="user-data-watcher")
+        self._watcher.start()
+    
+    def stop_watching(self):
+        """Stop the background file watcher"""
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
     
     def check_and_reload(self):
-        """Check if file has been modified and reload if necessary"""
+        """Check if storage has been modified and reload if necessary
+
+        Changes made by other bot processes sharing the storage are applied
+        one by one where the backend can follow them, anything else makes
+        the storage reload and the indexes get rebuilt.
+        """
         try:
-            if os.path.exists(self.filename):
-                current_mtime = os.path.getmtime(self.filename)
-                if current_mtime > self.last_modified_time:
-                    with open(self.filename, 'r', encoding='utf-8') as f:
-                        self.data = json.load(f)
-                    self.last_modified_time = current_mtime
-                    logger.info(f"Auto-reloaded {len(self.data)} user records from {self.filename}")
-                    return True
+            with self._index_lock:
+                changes = self.storage.read_external_changes()
+                for user_id, old_summary, new_summary in changes or ():
+                    self._record_summary_change(user_id, old_summary, new_summary)
+            if changes:
+                logger.info(f"Applied {len(changes)} external changes from {self.storage.filename}")
+                return True
+            if changes is None and self.storage.reload_if_changed():
+                self._rebuild_indexes()
+                logger.info(f"Auto-reloaded {self.stats.total_users} user records from {self.storage.filename}")
+                return True
         except Exception as e:
             logger.error(f"Error auto-reloading data: {e}")
         return False
     
     def reload_data(self):
-        """Reload data from JSON file (useful when file is modified externally)"""
+        """Reload data from storage (useful when file is modified externally)"""
         try:
-            if os.path.exists(self.filename):
-                with open(self.filename, 'r', encoding='utf-8') as f:
-                    self.data = json.load(f)
-                logger.info(f"Reloaded {len(self.data)} user records from {self.filename}")
-                return True
-            else:
-                self.data = {}
-                logger.info(f"Reloaded empty data file: {self.filename}")
-                return True
+            self.storage.reload()
+            self._rebuild_indexes()
+            logger.info(f"Reloaded {self.stats.total_users} user records from {self.storage.filename}")
+            return True
         except Exception as e:
             logger.error(f"Error reloading data: {e}")
             return False
@@ -65,17 +116,18 @@ class UserDataManager:
     def save_user_data(self, user_id, user_data):
         """Save user data with consent"""
         try:
-            # Check if user already exists to preserve consent date
-            existing_data = self.data.get(str(user_id))
-            consent_date = existing_data.get("consent_date") if existing_data else datetime.now().isoformat()
-            
-            self.data[str(user_id)] = {
-                "consent_given": True,
-                "consent_date": consent_date,
-                "data": user_data,
-                "last_updated": datetime.now().isoformat()
-            }
-            self.save_data()
+            with self._index_lock:
+                # Check if user already exists to preserve consent date
+                existing_data = self.storage.get(str(user_id))
+                consent_date = existing_data.get("consent_date") if existing_data else datetime.now().isoformat()
+                
+                self.storage.put(str(user_id), {
+                    "consent_given": True,
+                    "consent_date": consent_date,
+                    "data": user_data,
+                    "last_updated": datetime.now().isoformat()
+                })
+                self._record_change(int(user_id), existing_data, (True, consent_date))
             logger.info(f"Saved data for user {user_id}")
             return True
         except Exception as e:
@@ -83,42 +135,178 @@ class UserDataManager:
             return False
     
     def save_data(self):
-        """Save data to JSON file"""
+        """Write all data to storage"""
+        self.flush()
+    
+    def flush(self):
+        """Write changes that are still pending in memory"""
         try:
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
-            logger.info(f"Data saved to {self.filename}")
+            self.storage.flush()
         except Exception as e:
             logger.error(f"Error saving data: {e}")
     
     def get_user_data(self, user_id):
         """Get user data by ID"""
-        return self.data.get(str(user_id))
+        return self.storage.get(str(user_id))
     
     def user_has_consent(self, user_id):
         """Check if user has given consent"""
-        user_data = self.get_user_data(user_id)
-        return user_data and user_data.get("consent_given", False)
+        return int(user_id) in self.consent_index
+    
+    def consented_count(self):
+        """Number of users with consent"""
+        with self._index_lock:
+            return len(self.consent_index)
     
     def delete_user_data(self, user_id):
         """Delete user data (GDPR compliance)"""
-        if str(user_id) in self.data:
-            del self.data[str(user_id)]
-            self.save_data()
-            logger.info(f"Deleted data for user {user_id}")
-            return True
-        return False
+        with self._index_lock:
+            existing_data = self.storage.get(str(user_id))
+            if existing_data is None or not self.storage.delete(str(user_id)):
+                return False
+            self._record_change(int(user_id), existing_data, None)
+        logger.info(f"Deleted data for user {user_id}")
+        return True
+    
+    def delete_users(self, user_ids):
+        """Delete many users in one storage write, return list of deleted IDs"""
+        with self._index_lock:
+            removed = self.storage.delete_many([str(user_id) for user_id in user_ids])
+            for user_id, record in removed:
+                self._record_change(int(user_id), record, None)
+        if removed:
+            logger.info(f"Deleted data for {len(removed)} users")
+        return [user_id for user_id, _ in removed]
+    
+    def erase_deleted(self):
+        """Remove deleted users' data from disk (compacts or vacuums the store)
+
+        Deletes only write a journal entry or free a database page, the old
+        data stays in the files until this is called.
+        """
+        self.storage.erase_deleted()
+    
+    # -------------------------------------------------------------------------
+    # Async API for handlers
+    # -------------------------------------------------------------------------
+    
+    def user_lock(self, user_id):
+        """Get the asyncio lock serializing one user's read-modify-write flows
+
+        Locks are created on demand and dropped once nobody holds them, so
+        other users' updates never wait on each other.
+        """
+        lock = self._user_locks.get(int(user_id))
+        if lock is None:
+            lock = asyncio.Lock()
+            self._user_locks[int(user_id)] = lock
+        return lock
+    
+    async def aget_user_data(self, user_id):
+        """Get user data by ID without blocking the event loop"""
+        return await self._run_storage(self.get_user_data, user_id)
+    
+    async def asave_user_data(self, user_id, user_data):
+        """Save user data with consent without blocking the event loop"""
+        return await self._run_storage(self.save_user_data, user_id, user_data)
+    
+    async def adelete_user_data(self, user_id):
+        """Delete user data without blocking the event loop"""
+        return await self._run_storage(self.delete_user_data, user_id)
+    
+    async def _run_storage(self, func, *args):
+        # In-memory backends answer right away, disk-backed ones go to a worker thread
+        if self.storage.blocking_io:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+    
+    def consented_user_ids(self, after=-1):
+        """Iterate over IDs of users with consent greater than after, ascending
+
+        Streamed from a snapshot of the consent index, so it neither copies
+        the IDs nor sees consents given or withdrawn while iterating.
+        """
+        with self._index_lock:
+            return self.consent_index.iter_after(after)
     
     def get_all_users(self):
-        """Get all user IDs"""
-        return list(self.data.keys())
+        """Iterate over all user IDs (streamed from storage, not materialized)"""
+        return self.storage.user_ids()
     
     def get_stats(self):
         """Get data collection statistics"""
-        total_users = len(self.data)
-        users_with_consent = sum(1 for user in self.data.values() if user.get("consent_given", False))
-        return {
-            "total_users": total_users,
-            "users_with_consent": users_with_consent,
-            "consent_rate": (users_with_consent / total_users * 100) if total_users > 0 else 0
-        } 
\ No newline at end of file
+        with self._index_lock:
+            return self.stats.as_dict()
+    
+    def close(self):
+        """Write pending changes and close the storage"""
+        self.stop_watching()
+        self.storage.close()
+    
+    # -------------------------------------------------------------------------
+    # Consent index and statistics
+    # -------------------------------------------------------------------------
+    
+    def _record_change(self, user_id, old_record, new_summary):
+        """Apply a change to the index and counters (called with _index_lock held)"""
+        old_summary = None
+        if old_record is not None:
+            old_summary = (bool(old_record.get("consent_given", False)), old_record.get("consent_date"))
+        self._record_summary_change(user_id, old_summary, new_summary)
+    
+    def _record_summary_change(self, user_id, old_summary, new_summary):
+        self._apply_change(self.consent_index, self.stats, user_id, old_summary, new_summary)
+        if self._index_changes is not None:
+            self._index_changes.append((user_id, old_summary, new_summary))
+    
+    @staticmethod
+    def _apply_change(index, stats, user_id, old_summary, new_summary):
+        if old_summary is not None:
+            stats.remove(*old_summary)
+        if new_summary is not None:
+            stats.add(*new_summary)
+        if new_summary is not None and new_summary[0]:
+            index.add(user_id)
+        else:
+            index.discard(user_id)
+    
+    def _rebuild_indexes(self):
+        """Build a fresh consent index and counters from storage and swap them in
+
+        Storage is scanned chunk by chunk. Each chunk is taken under the
+        index lock, so a change recorded after a chunk was taken is missing
+        from it and gets replayed on the new index and counters before the
+        swap, while earlier changes are already in the chunk. Nothing is lost
+        or counted twice.
+        """
+        stats = UserStats()
+        consented = array('q')
+        chunk_positions = {}
+        with self._index_lock:
+            chunks = self.storage.consent_summary_chunks()
+            changes = self._index_changes = []
+        try:
+            while True:
+                with self._index_lock:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    chunk_key, summaries = chunk
+                    chunk_positions[chunk_key] = len(changes)
+                for user_id, consent_given, consent_date in summaries:
+                    stats.add(consent_given, consent_date)
+                    if consent_given:
+                        consented.append(user_id)
+            index = ConsentIndex(consented)
+            del consented
+        except Exception:
+            with self._index_lock:
+                self._index_changes = None
+            raise
+        with self._index_lock:
+            for position, (user_id, old_summary, new_summary) in enumerate(changes):
+                if position >= chunk_positions.get(self.storage.chunk_of(user_id), 0):
+                    self._apply_change(index, stats, user_id, old_summary, new_summary)
+            self.consent_index = index
+            self.stats = stats
+            self._index_changes = None
@@ -1,28 +1,124 @@
 #!/usr/bin/env python3
 """
-Script to delete a specific user from data storage
+Script to delete or export users in data storage (GDPR requests)
+
+User IDs are given as arguments, or one per line in a file (--file, "-"
+for stdin). Blank lines and lines starting with # are ignored.
+
+    python3 delete_user.py delete 5202466309
+    python3 delete_user.py delete --file ids.txt
+    python3 delete_user.py export --file ids.txt --output export.jsonl
 """
 
+import argparse
+import json
+import sys
+import time
 from data_manager import UserDataManager
 
-def delete_user(user_id):
-    """Delete user from data storage"""
-    data_manager = UserDataManager()
+# IDs handled per storage write; bounds memory for huge ID lists
+BATCH_SIZE = 100000
+PROGRESS_EVERY = 10000
+
+def read_user_ids(args):
+    """Stream user IDs from arguments or from a file/stdin"""
+    yield from args.user_ids
+    if args.file is None:
+        return
+    source = sys.stdin if args.file == "-" else open(args.file, 'r', encoding='utf-8')
+    try:
+        for line_number, line in enumerate(source, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if not line.isdigit():
+                print(f"⚠️ Skipping invalid user ID on line {line_number}: {line}", file=sys.stderr)
+                continue
+            yield line
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+def batches(user_ids, size):
+    batch = []
+    for user_id in user_ids:
+        batch.append(user_id)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def report_progress(action, processed, started):
+    elapsed = time.monotonic() - started
+    rate = processed / elapsed if elapsed > 0 else 0
+    print(f"   {action} {processed} IDs ({elapsed:.1f}s, {rate:.0f} IDs/s)", file=sys.stderr)
+
+def delete_users(data_manager, user_ids, batch_size=BATCH_SIZE):
+    """Delete users from data storage"""
+    started = time.monotonic()
+    processed = 0
+    deleted = 0
     
-    print(f"Attempting to delete user {user_id}...")
+    print("Deleting users...", file=sys.stderr)
+    for batch in batches(user_ids, batch_size):
+        deleted += len(data_manager.delete_users(batch))
+        processed += len(batch)
+        report_progress("processed", processed, started)
+    # Deletes alone leave the old data in the journal/snapshot or free database pages
+    print("Erasing deleted data from disk...", file=sys.stderr)
+    data_manager.erase_deleted()
+    data_manager.close()
     
-    if data_manager.delete_user_data(user_id):
-        print(f"✅ User {user_id} successfully deleted!")
-        
-        # Show updated stats
-        stats = data_manager.get_stats()
-        print(f"📊 Updated stats:")
-        print(f"   Total users: {stats['total_users']}")
-        print(f"   Users with consent: {stats['users_with_consent']}")
-        print(f"   Consent rate: {stats['consent_rate']:.1f}%")
-    else:
-        print(f"❌ User {user_id} not found in data storage")
+    print(f"✅ Deleted {deleted} of {processed} requested users in {time.monotonic() - started:.2f}s", file=sys.stderr)
+    if deleted < processed:
+        print(f"❌ {processed - deleted} users not found in data storage", file=sys.stderr)
+    
+    # Show updated stats
+    stats = data_manager.get_stats()
+    print("📊 Updated stats:", file=sys.stderr)
+    print(f"   Total users: {stats['total_users']}", file=sys.stderr)
+    print(f"   Users with consent: {stats['users_with_consent']}", file=sys.stderr)
+    print(f"   Consent rate: {stats['consent_rate']:.1f}%", file=sys.stderr)
+
+def export_users(data_manager, user_ids, output):
+    """Write stored data of users as JSON lines"""
+    started = time.monotonic()
+    processed = 0
+    exported = 0
+    
+    print("Exporting users...", file=sys.stderr)
+    for user_id in user_ids:
+        record = data_manager.get_user_data(user_id)
+        processed += 1
+        if record is not None:
+            output.write(json.dumps({"user_id": str(user_id), "record": record}, ensure_ascii=False) + "\n")
+            exported += 1
+        if processed % PROGRESS_EVERY == 0:
+            report_progress("processed", processed, started)
+    output.flush()
+    data_manager.close()
+    
+    print(f"✅ Exported {exported} of {processed} requested users in {time.monotonic() - started:.2f}s", file=sys.stderr)
 
 if __name__ == "__main__":
-    user_id = 5202466309
-    delete_user(user_id) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Delete or export users in data storage (GDPR requests)")
+    parser.add_argument("command", choices=["delete", "export"])
+    parser.add_argument("user_ids", nargs="*", help="User IDs")
+    parser.add_argument("--file", help="File with one user ID per line, - for stdin")
+    parser.add_argument("--output", help="Export destination (default: stdout)")
+    args = parser.parse_intermixed_args()
+    
+    if not args.user_ids and args.file is None:
+        parser.error("give user IDs as arguments or with --file")
+    
+    data_manager = UserDataManager()
+    if args.command == "delete":
+        delete_users(data_manager, read_user_ids(args))
+    else:
+        output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            export_users(data_manager, read_user_ids(args), output)
+        finally:
+            if output is not sys.stdout:
+                output.close()
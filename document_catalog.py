@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+from file_id_cache import _hash_file
+from file_watcher import FileWatcher
+
+logger = logging.getLogger(__name__)
+
+class DocumentInfo:
+    """Name, size, modification time and content hash of a document"""
+    
+    __slots__ = ("name", "path", "size", "mtime_ns", "sha256")
+    
+    def __init__(self, name, path, size, mtime_ns, sha256):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sha256 = sha256
+
+class DocumentCatalog:
+    """In-memory index of the files in a directory plus some extra files
+
+    Built once at startup and refreshed by a file watcher, so checking
+    whether a document exists, listing documents or getting its content
+    hash never touches the filesystem. Files whose size and mtime did not
+    change keep their hash on refresh. The index is replaced as a whole,
+    readers see either the old or the new one.
+    """
+    
+    def __init__(self, directory, extra_files=()):
+        self.directory = directory
+        self.extra_files = list(extra_files)
+        # path -> DocumentInfo
+        self._documents = {}
+        self._directory_files = []
+        self._refresh_lock = threading.Lock()
+        self._watcher = None
+        self.refresh()
+    
+    def __contains__(self, path):
+        return path in self._documents
+    
+    def get(self, path):
+        """DocumentInfo of a file by its path, None if it does not exist"""
+        return self._documents.get(path)
+    
+    def directory_files(self):
+        """Names of the files in the directory, sorted"""
+        return list(self._directory_files)
+    
+    def refresh(self):
+        """Scan the directory and the extra files again"""
+        with self._refresh_lock:
+            previous = self._documents
+            documents = {}
+            paths = []
+            try:
+                with os.scandir(self.directory) as entries:
+                    paths = sorted((entry.name, entry.path) for entry in entries if entry.is_file())
+            except FileNotFoundError:
+                pass
+            directory_paths = {path for _, path in paths}
+            paths.extend((os.path.basename(path), path) for path in self.extra_files)
+            for name, path in paths:
+                try:
+                    stat = os.stat(path)
+                    known = previous.get(path)
+                    if known is not None and (known.size, known.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                        sha256 = known.sha256
+                    else:
+                        sha256 = _hash_file(path)
+                except OSError:
+                    # Missing or deleted while scanning
+                    continue
+                documents[path] = DocumentInfo(name, path, stat.st_size, stat.st_mtime_ns, sha256)
+            self._documents = documents
+            self._directory_files = [info.name for info in documents.values() if info.path in directory_paths]
+        logger.info(f"Indexed {len(documents)} documents")
+    
+    def start_watching(self, poll_interval=1.0):
+        """Refresh in a background thread whenever the directory or an extra file changes"""
+        if self._watcher is not None:
+            return
+        self._watcher = FileWatcher([self.directory, *self.extra_files], self.refresh, poll_interval=poll_interval, name="documents-watcher")
+        self._watcher.start()
+    
+    def stop_watching(self):
+        """Stop the background file watcher"""
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from telegram import InputMediaDocument
+from telegram.error import BadRequest
+from storage.atomic_file import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Parts of BadRequest messages saying the file_id itself was not accepted
+# ("Wrong file identifier/HTTP URL specified", "FILE_REFERENCE_EXPIRED", ...)
+FILE_ID_ERRORS = ("file identifier", "file_id", "file reference", "file_reference")
+
+def _is_file_id_error(error):
+    """Check whether a BadRequest was caused by the file_id sent"""
+    message = str(error).lower()
+    return any(part in message for part in FILE_ID_ERRORS)
+
+def _signature(path):
+    """(mtime_ns, size) of a file, None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _read_file(path):
+    """Signature, content and SHA-256 of a file, the signature taken before reading"""
+    signature = _signature(path)
+    with open(path, 'rb') as f:
+        content = f.read()
+    return signature, content, hashlib.sha256(content).hexdigest()
+
+class DocumentBytesCache:
+    """Size-bounded LRU cache of document contents for uploads
+
+    Files are read in a worker thread, so the event loop never waits for
+    the disk, and files up to max_file_size are kept for the next upload.
+    A cached content is used only while the file keeps its size and mtime
+    (taken from the DocumentCatalog when given, otherwise from os.stat).
+    """
+    
+    def __init__(self, max_bytes, max_file_size, catalog=None):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.catalog = catalog
+        # path -> (signature, content, sha256), least recently used first
+        self._entries = OrderedDict()
+        self._size = 0
+    
+    async def read(self, path):
+        """Signature, content and SHA-256 of a file, from memory when unchanged"""
+        cached = self._entries.get(path)
+        if cached is not None:
+            info = self.catalog.get(path) if self.catalog is not None else None
+            signature = [info.mtime_ns, info.size] if info is not None else _signature(path)
+            if signature == cached[0]:
+                self._entries.move_to_end(path)
+                return cached
+            self._drop(path)
+        
+        entry = await asyncio.to_thread(_read_file, path)
+        size = len(entry[1])
+        if size <= self.max_file_size:
+            self._drop(path)
+            self._entries[path] = entry
+            self._size += size
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+        return entry
+    
+    def _drop(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+class FileIdCache:
+    """Persistent cache of Telegram file_ids of uploaded documents
+
+    A document is uploaded once; the file_id from the response is stored
+    with the SHA-256 of the uploaded content and every later send reuses
+    it. A send only stats the file: when its mtime or size changed the
+    content is hashed again and a different hash drops the file_id, so an
+    edited file is uploaded anew. Files indexed by a DocumentCatalog are
+    compared by the catalog's hash without touching the disk.
+    """
+    
+    def __init__(self, filename, catalog=None, content_cache=None):
+        self.filename = filename
+        self.catalog = catalog
+        # Contents for uploads, read in a worker thread if not given
+        self.content_cache = content_cache
+        # path -> {"signature": [mtime_ns, size], "sha256": ..., "file_id": ...}
+        self._entries = {}
+        try:
+            if os.path.exists(filename):
+                with open(filename, encoding='utf-8') as f:
+                    self._entries = json.load(f)
+        except Exception as e:
+            logger.error(f"Error reading file_id cache {filename}: {e}")
+    
+    async def send_document(self, bot, chat_id, path, filename=None, **kwargs):
+        """Send a file by its cached file_id or upload it, return the sent message"""
+        file_id = await self._current_file_id(path)
+        if file_id is not None:
+            try:
+                return await bot.send_document(chat_id=chat_id, document=file_id, **kwargs)
+            except BadRequest as e:
+                # E.g. the file_id belongs to another bot token. Other errors
+                # (unknown chat, bad caption) would fail an upload just the same.
+                if not _is_file_id_error(e):
+                    raise
+                logger.warning(f"Cached file_id of {path} was rejected, uploading again: {e}")
+                self.invalidate(path)
+        
+        signature, content, digest = await self._read(path)
+        message = await bot.send_document(
+            chat_id=chat_id,
+            document=content,
+            filename=filename or os.path.basename(path),
+            **kwargs
+        )
+        if message.document is not None:
+            self._remember(path, signature, digest, message.document.file_id)
+            self._save()
+        return message
+    
+    async def prewarm(self, bot, chat_id, documents, concurrency=4):
+        """Upload (path, filename) documents without a current file_id to a chat
+
+        At most concurrency uploads run at once. Failures are logged and
+        leave the document to be uploaded on its first real send.
+        """
+        started = time.monotonic()
+        pending = [(path, filename) for path, filename in documents if await self._current_file_id(path) is None]
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def upload(path, filename):
+            async with semaphore:
+                try:
+                    message = await self.send_document(bot, chat_id, path, filename=filename, disable_notification=True)
+                    return (message.document.file_size or 0) if message.document is not None else 0
+                except Exception as e:
+                    logger.error(f"Error pre-uploading {path}: {e}")
+                    return None
+        
+        sizes = await asyncio.gather(*(upload(path, filename) for path, filename in pending))
+        uploaded = [size for size in sizes if size is not None]
+        elapsed = time.monotonic() - started
+        megabytes = sum(uploaded) / (1024 * 1024)
+        logger.info(f"Pre-warmed {len(uploaded)} documents ({megabytes:.1f} MB) in {elapsed:.2f}s, "
+                    f"{megabytes / elapsed if elapsed > 0 else 0:.2f} MB/s; "
+                    f"{len(documents) - len(pending)} already cached, {len(sizes) - len(uploaded)} failed")
+    
+    async def send_media_group(self, bot, chat_id, documents):
+        """Send (path, filename, caption) documents as one media group, return the sent messages
+
+        Documents with a cached file_id are sent by it, the others are
+        uploaded within the same request and their file_ids cached.
+        """
+        file_ids = [await self._current_file_id(path) for path, _, _ in documents]
+        try:
+            return await self._send_media_group(bot, chat_id, documents, file_ids)
+        except BadRequest as e:
+            if not any(file_ids) or not _is_file_id_error(e):
+                raise
+            logger.warning(f"Cached file_ids were rejected, uploading the media group again: {e}")
+            for path, _, _ in documents:
+                self.invalidate(path)
+            return await self._send_media_group(bot, chat_id, documents, [None] * len(documents))
+    
+    def invalidate(self, path):
+        """Forget the file_id of a file"""
+        if self._entries.pop(path, None) is not None:
+            self._save()
+    
+    async def _send_media_group(self, bot, chat_id, documents, file_ids):
+        media = []
+        uploads = {}
+        for (path, filename, caption), file_id in zip(documents, file_ids):
+            if file_id is None:
+                signature, content, digest = await self._read(path)
+                uploads[len(media)] = (path, signature, digest)
+                media.append(InputMediaDocument(content, filename=filename or os.path.basename(path), caption=caption))
+            else:
+                media.append(InputMediaDocument(file_id, caption=caption))
+        messages = await bot.send_media_group(chat_id=chat_id, media=media)
+        # Messages come back in the order of the media
+        for position, (path, signature, digest) in uploads.items():
+            if position < len(messages) and messages[position].document is not None:
+                self._remember(path, signature, digest, messages[position].document.file_id)
+        if uploads:
+            self._save()
+        return messages
+    
+    async def _read(self, path):
+        if self.content_cache is not None:
+            return await self.content_cache.read(path)
+        return await asyncio.to_thread(_read_file, path)
+    
+    def _remember(self, path, signature, digest, file_id):
+        self._entries[path] = {"signature": signature, "sha256": digest, "file_id": file_id}
+    
+    async def _current_file_id(self, path):
+        """Cached file_id if it was uploaded with the current content of the file"""
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        info = self.catalog.get(path) if self.catalog is not None else None
+        if info is not None:
+            if info.sha256 == entry["sha256"]:
+                return entry["file_id"]
+            logger.info(f"{path} changed on disk, it will be uploaded again")
+            self.invalidate(path)
+            return None
+        signature = _signature(path)
+        if signature == entry["signature"]:
+            return entry["file_id"]
+        if signature is not None:
+            # Modified or just touched, the content decides
+            digest = await asyncio.to_thread(_hash_file, path)
+            if digest == entry["sha256"]:
+                entry["signature"] = signature
+                self._save()
+                return entry["file_id"]
+        logger.info(f"{path} changed on disk, it will be uploaded again")
+        self.invalidate(path)
+        return None
+    
+    def _save(self):
+        """Write the cache atomically, a failed write only costs extra uploads"""
+        try:
+            write_atomic(self.filename, json.dumps(self._entries, ensure_ascii=False, indent=2))
+        except Exception as e:
+            logger.error(f"Error writing file_id cache {self.filename}: {e}")
@@ -0,0 +1,175 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# inotify event masks (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")
+
+def _load_libc():
+    """Get libc with inotify support or None on other platforms"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+class FileWatcher:
+    """Watches files and directories and calls back when they change
+
+    Runs in a background thread. Uses inotify where available and falls
+    back to polling os.stat every poll_interval seconds. Changes are
+    debounced, so a burst of writes results in a single callback, which is
+    called from the watcher thread.
+    """
+
+    def __init__(self, paths, callback, poll_interval=1.0, debounce=0.2, name="file-watcher"):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.name = name
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching in a background thread"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching and wait for the thread to finish"""
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        fd = self._init_inotify()
+        if fd is None:
+            logger.info(f"{self.name}: polling {len(self.paths)} paths every {self.poll_interval}s")
+            self._poll()
+        else:
+            logger.info(f"{self.name}: watching {len(self.paths)} paths with inotify")
+            try:
+                self._watch(fd)
+            finally:
+                os.close(fd)
+
+    def _notify(self):
+        try:
+            self.callback()
+        except Exception as e:
+            logger.error(f"{self.name}: error handling change: {e}")
+
+    # -------------------------------------------------------------------------
+    # inotify
+    # -------------------------------------------------------------------------
+
+    def _init_inotify(self):
+        """Set up inotify watches, return the descriptor or None to fall back to polling"""
+        libc = _load_libc()
+        if libc is None:
+            return None
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        # Files are replaced atomically (os.replace), which swaps the inode,
+        # so the parent directory is watched instead of the file itself
+        self._watches = {}
+        for path in self.paths:
+            directory, name = (path, None) if os.path.isdir(path) else os.path.split(path)
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                os.close(fd)
+                return None
+            self._watches.setdefault(wd, set()).add(name)
+        return fd
+
+    def _watch(self, fd):
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([fd], [], [], 0.5)
+            if not readable:
+                continue
+            changed = self._read_events(fd)
+            # Collect the rest of a burst before calling back
+            deadline = time.monotonic() + self.debounce
+            while not self._stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                readable, _, _ = select.select([fd], [], [], remaining)
+                if readable:
+                    changed = self._read_events(fd) or changed
+            if changed:
+                self._notify()
+
+    def _read_events(self, fd):
+        """Drain pending events, return True if any of them is relevant"""
+        relevant = False
+        while True:
+            try:
+                buffer = os.read(fd, 64 * 1024)
+            except BlockingIOError:
+                return relevant
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(buffer[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                names = self._watches.get(wd, ())
+                if None in names or name in names:
+                    relevant = True
+
+    # -------------------------------------------------------------------------
+    # Polling fallback
+    # -------------------------------------------------------------------------
+
+    def _poll(self):
+        state = self._stat_all()
+        while not self._stop_event.wait(self.poll_interval):
+            current = self._stat_all()
+            if current != state:
+                state = current
+                self._notify()
+
+    def _stat_all(self):
+        return tuple(self._stat(path) for path in self.paths)
+
+    @staticmethod
+    def _stat(path):
+        try:
+            if os.path.isdir(path):
+                with os.scandir(path) as entries:
+                    return tuple(sorted(
+                        (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size) for entry in entries
+                    ))
+            stat = os.stat(path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
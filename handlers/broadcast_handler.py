@@ -0,0 +1,286 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from telegram import Update
+from telegram.error import BadRequest, Forbidden
+from telegram.ext import ContextTypes
+from config import BROADCAST, FILES, MESSAGES
+from rate_limiter import PRIORITY_BACKGROUND
+from storage.atomic_file import write_atomic
+from storage.file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+class BroadcastProgress:
+    """Text, counters and position of a broadcast, kept in the checkpoint file"""
+    
+    __slots__ = ("text", "admin_chat_id", "total", "sent", "blocked", "failed", "skipped", "last_user_id", "done_after", "started_at")
+    
+    def __init__(self, text, admin_chat_id, total):
+        self.text = text
+        self.admin_chat_id = admin_chat_id
+        self.total = total
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+        # Known to have blocked the bot or withdrew consent since the start
+        self.skipped = 0
+        # Every user up to last_user_id is done, plus the users in done_after
+        self.last_user_id = -1
+        self.done_after = []
+        self.started_at = time.time()
+    
+    @property
+    def done(self):
+        return self.sent + self.blocked + self.failed + self.skipped
+    
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+    
+    @classmethod
+    def from_dict(cls, data):
+        progress = cls(data["text"], data["admin_chat_id"], data["total"])
+        for name in cls.__slots__:
+            if name in data:
+                setattr(progress, name, data[name])
+        return progress
+
+class BroadcastHandler:
+    """Sends a message to every user with consent, resumable after a restart
+
+    User IDs are streamed in ascending order from the consent index and up
+    to BROADCAST["concurrency"] messages are in flight at once. The rate
+    limiter paces them at background priority, so a broadcast runs at
+    Telegram's global limit without delaying replies to users. Progress is
+    checkpointed as the ID below which every user is done plus the few
+    finished IDs above it, so after a restart nobody is skipped and only
+    sends in flight at a crash can be repeated. Users who blocked the bot
+    or deleted their account are remembered and skipped next time.
+    
+    With several bot processes, the one holding the lock on the checkpoint
+    runs the broadcast, the others neither start nor resume one.
+    """
+    
+    def __init__(self, data_manager, checkpoint_file=None, blocked_file=None):
+        self.data_manager = data_manager
+        self.checkpoint_file = checkpoint_file or FILES["broadcast"]
+        self.blocked_file = blocked_file or FILES["blocked_users"]
+        # Held by the process running a broadcast, released when it finishes or stops
+        self._run_lock = FileLock(f"{self.checkpoint_file}.lock")
+        self.concurrency = BROADCAST["concurrency"]
+        self.checkpoint_interval = BROADCAST["checkpoint_interval"]
+        self.progress = None
+        self._task = None
+        self._stopping = False
+        # Started but not finished, in start order, and finished ones still behind an unfinished one
+        self._started = deque()
+        self._finished = set()
+        self._saved_at = 0.0
+        self._blocked = self._read_blocked()
+    
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+    
+    async def broadcast_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /broadcast admin command: start a broadcast or show its progress"""
+        text = update.message.text.partition(" ")[2].strip()
+        if not text:
+            if self.progress is None:
+                await update.message.reply_text(MESSAGES["broadcast_usage"])
+            else:
+                await update.message.reply_text(self._format_progress(MESSAGES["broadcast_status"]))
+            return
+        if self.running or not self._run_lock.acquire(blocking=False):
+            await update.message.reply_text(MESSAGES["broadcast_busy"])
+            return
+        self.progress = BroadcastProgress(text, update.effective_chat.id, self.data_manager.consented_count())
+        self._save_checkpoint()
+        self._start(context.bot)
+        await update.message.reply_text(MESSAGES["broadcast_started"].format(total=self.progress.total))
+    
+    def resume(self, bot):
+        """Continue a broadcast interrupted by a restart, return True if there was one"""
+        if self.running or not self._run_lock.acquire(blocking=False):
+            # Another process is running it
+            return False
+        try:
+            with open(self.checkpoint_file, encoding='utf-8') as f:
+                self.progress = BroadcastProgress.from_dict(json.load(f))
+        except FileNotFoundError:
+            self._run_lock.release()
+            return False
+        except Exception as e:
+            self._run_lock.release()
+            logger.error(f"Error reading broadcast checkpoint {self.checkpoint_file}: {e}")
+            return False
+        logger.info(f"Resuming broadcast after user {self.progress.last_user_id} ({self.progress.done}/{self.progress.total} done)")
+        self._start(bot)
+        return True
+    
+    async def stop(self):
+        """Stop a running broadcast, it resumes from the checkpoint on the next start
+
+        No new messages are started and the ones in flight get up to
+        BROADCAST["stop_timeout"] seconds to finish. Only those cancelled
+        after that can be sent twice.
+        """
+        if self.running:
+            self._stopping = True
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), BROADCAST["stop_timeout"])
+            except asyncio.TimeoutError:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+    
+    def forget_blocked(self, user_id):
+        """Include a user in broadcasts again (e.g. after they unblocked the bot and pressed /start)"""
+        if user_id not in self._blocked:
+            return
+        self._blocked.discard(user_id)
+        try:
+            write_atomic(self.blocked_file, "".join(f"{blocked}\n" for blocked in sorted(self._blocked)))
+        except Exception as e:
+            logger.error(f"Error writing blocked users to {self.blocked_file}: {e}")
+    
+    def _start(self, bot):
+        self._stopping = False
+        self._started.clear()
+        self._finished = set(self.progress.done_after)
+        self._saved_at = time.monotonic()
+        self._task = asyncio.create_task(self._run(bot))
+        self._task.add_done_callback(lambda task: self._run_lock.release())
+    
+    async def _run(self, bot):
+        progress = self.progress
+        slots = asyncio.Semaphore(self.concurrency)
+        sending = set()
+        try:
+            for user_id in self.data_manager.consented_user_ids(progress.last_user_id):
+                if self._stopping:
+                    break
+                self._started.append(user_id)
+                if user_id in self._finished:
+                    # Sent before the restart
+                    self._advance()
+                    continue
+                if user_id in self._blocked or not self.data_manager.user_has_consent(user_id):
+                    progress.skipped += 1
+                    self._finish(user_id)
+                    continue
+                await slots.acquire()
+                if self._stopping:
+                    # Stays unfinished, so it is sent on resume
+                    slots.release()
+                    break
+                task = asyncio.create_task(self._send(bot, user_id, slots))
+                sending.add(task)
+                task.add_done_callback(sending.discard)
+            if sending:
+                await asyncio.gather(*sending)
+        except asyncio.CancelledError:
+            for task in sending:
+                task.cancel()
+            await asyncio.gather(*sending, return_exceptions=True)
+            self._save_checkpoint()
+            logger.info(f"Broadcast stopped after user {progress.last_user_id} ({progress.done}/{progress.total} done)")
+            raise
+        if self._stopping:
+            self._save_checkpoint()
+            logger.info(f"Broadcast stopped after user {progress.last_user_id} ({progress.done}/{progress.total} done)")
+            return
+        self._remove_checkpoint()
+        elapsed = time.time() - progress.started_at
+        logger.info(f"Broadcast finished in {elapsed:.0f}s: {progress.sent} sent, {progress.blocked} blocked, {progress.failed} failed")
+        try:
+            await bot.send_message(progress.admin_chat_id, self._format_progress(MESSAGES["broadcast_finished"]))
+        except Exception as e:
+            logger.error(f"Error reporting broadcast result: {e}")
+    
+    async def _send(self, bot, user_id, slots):
+        progress = self.progress
+        try:
+            await bot.send_message(user_id, progress.text, rate_limit_args={"priority": PRIORITY_BACKGROUND})
+            progress.sent += 1
+        except Forbidden:
+            # Blocked the bot or deactivated the account
+            self._add_blocked(user_id)
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                self._add_blocked(user_id)
+            else:
+                progress.failed += 1
+                logger.warning(f"Broadcast to {user_id} failed: {e}")
+        except Exception as e:
+            progress.failed += 1
+            logger.warning(f"Broadcast to {user_id} failed: {e}")
+        finally:
+            slots.release()
+        # Not reached when cancelled, the user is sent to again on resume
+        self._finish(user_id)
+    
+    def _finish(self, user_id):
+        self._finished.add(user_id)
+        self._advance()
+        if time.monotonic() - self._saved_at >= self.checkpoint_interval:
+            self._save_checkpoint()
+    
+    def _advance(self):
+        """Move last_user_id past the users finished in start order"""
+        started = self._started
+        finished = self._finished
+        while started and started[0] in finished:
+            user_id = started.popleft()
+            finished.discard(user_id)
+            self.progress.last_user_id = user_id
+    
+    def _add_blocked(self, user_id):
+        self.progress.blocked += 1
+        self._blocked.add(user_id)
+        try:
+            with open(self.blocked_file, 'a', encoding='utf-8') as f:
+                f.write(f"{user_id}\n")
+        except Exception as e:
+            logger.error(f"Error writing blocked users to {self.blocked_file}: {e}")
+    
+    def _read_blocked(self):
+        try:
+            with open(self.blocked_file, encoding='utf-8') as f:
+                return {int(line) for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+        except Exception as e:
+            logger.error(f"Error reading blocked users from {self.blocked_file}: {e}")
+            return set()
+    
+    def _format_progress(self, template):
+        progress = self.progress
+        return template.format(
+            done=progress.done,
+            total=progress.total,
+            sent=progress.sent,
+            blocked=progress.blocked,
+            failed=progress.failed,
+            minutes=(time.time() - progress.started_at) / 60
+        )
+    
+    def _save_checkpoint(self):
+        self.progress.done_after = sorted(self._finished)
+        self._saved_at = time.monotonic()
+        try:
+            write_atomic(self.checkpoint_file, json.dumps(self.progress.to_dict(), ensure_ascii=False))
+        except Exception as e:
+            logger.error(f"Error writing broadcast checkpoint {self.checkpoint_file}: {e}")
+    
+    def _remove_checkpoint(self):
+        try:
+            os.remove(self.checkpoint_file)
+        except FileNotFoundError:
+            pass
@@ -70,67 +70,65 @@ class DataCollectionHandler:
         """User agreed to data processing"""
         user = query.from_user
         
-        # Force reload data to get the latest user data
-        self.data_manager.reload_data()
-        
-        # Small delay to ensure file is written
-        import time
-        time.sleep(0.1)
-        
-        # Check if user already exists in our database
-        existing_user_data = self.data_manager.get_user_data(user.id)
-        
-        # Debug logging
-        logger.info(f"User {user.id} existing data: {existing_user_data}")
-        
-        # Check if user has phone number (either in data or directly in user_data)
-        has_phone = False
-        if existing_user_data:
-            # Check in the data object
-            if existing_user_data.get("data", {}).get("phone"):
-                has_phone = True
-                logger.info(f"User {user.id} has phone in data: {existing_user_data.get('data', {}).get('phone')}")
-            # Also check if phone is directly in user_data (for backward compatibility)
-            elif existing_user_data.get("phone"):
-                has_phone = True
-                logger.info(f"User {user.id} has phone directly: {existing_user_data.get('phone')}")
-        
-        logger.info(f"User {user.id} has_phone: {has_phone}")
-        
-        if has_phone:
-            # User already exists with phone number - go directly to main menu
-            await query.edit_message_text(
-                "Спасибо! Ваши данные уже сохранены в нашей базе."
-            )
+        # Check if user already exists in our database and answer accordingly.
+        # The per-user lock is held until the reply is sent, so a contact that
+        # is being saved right now is seen here and a second press of the
+        # button waits for this one; external edits are picked up by the data
+        # manager's file watcher.
+        async with self.data_manager.user_lock(user.id):
+            existing_user_data = await self.data_manager.aget_user_data(user.id)
             
-            # Send main menu directly
-            keyboard = [
-                [InlineKeyboardButton(BUTTONS["useful_files"], callback_data="useful_files")],
-                [InlineKeyboardButton(BUTTONS["calculation"], callback_data="calculation")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.bot.send_message(
-                chat_id=query.from_user.id,
-                text="приветственное сообщение",
-                reply_markup=reply_markup
-            )
-        else:
-            # New user or user without phone - request contact information
-            await query.edit_message_text(
-                "Спасибо! Теперь нажмите кнопку 'Поделиться контактом' для предоставления ваших данных:"
-            )
+            # Debug logging
+            logger.info(f"User {user.id} existing data: {existing_user_data}")
             
-            # Then send a new message with the contact keyboard
-            keyboard = [
-                [KeyboardButton("📱 Поделиться контактом", request_contact=True)]
-            ]
-            reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+            # Check if user has phone number (either in data or directly in user_data)
+            has_phone = False
+            if existing_user_data:
+                # Check in the data object
+                if existing_user_data.get("data", {}).get("phone"):
+                    has_phone = True
+                    logger.info(f"User {user.id} has phone in data: {existing_user_data.get('data', {}).get('phone')}")
+                # Also check if phone is directly in user_data (for backward compatibility)
+                elif existing_user_data.get("phone"):
+                    has_phone = True
+                    logger.info(f"User {user.id} has phone directly: {existing_user_data.get('phone')}")
             
-            await context.bot.send_message(
-                chat_id=query.from_user.id,
-                text="Нажмите кнопку ниже:",
-                reply_markup=reply_markup
-            )
+            logger.info(f"User {user.id} has_phone: {has_phone}")
+            
+            if has_phone:
+                # User already exists with phone number - go directly to main menu
+                await query.edit_message_text(
+                    "Спасибо! Ваши данные уже сохранены в нашей базе."
+                )
+                
+                # Send main menu directly
+                keyboard = [
+                    [InlineKeyboardButton(BUTTONS["useful_files"], callback_data="useful_files")],
+                    [InlineKeyboardButton(BUTTONS["calculation"], callback_data="calculation")]
+                ]
+                reply_markup = InlineKeyboardMarkup(keyboard)
+                await context.bot.send_message(
+                    chat_id=query.from_user.id,
+                    text="приветственное сообщение",
+                    reply_markup=reply_markup
+                )
+            else:
+                # New user or user without phone - request contact information
+                await query.edit_message_text(
+                    "Спасибо! Теперь нажмите кнопку 'Поделиться контактом' для предоставления ваших данных:"
+                )
+                
+                # Then send a new message with the contact keyboard
+                keyboard = [
+                    [KeyboardButton("📱 Поделиться контактом", request_contact=True)]
+                ]
+                reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+                
+                await context.bot.send_message(
+                    chat_id=query.from_user.id,
+                    text="Нажмите кнопку ниже:",
+                    reply_markup=reply_markup
+                )
     
     async def handle_consent_no(self, query, context):
         """User declined data processing"""
@@ -162,8 +160,12 @@ class DataCollectionHandler:
                 "phone": phone
             }
             
-            # Save all data to JSON
-            if self.data_manager.save_user_data(user.id, user_data):
+            # Save all data. The user lock keeps the save from landing in the
+            # middle of a consent check of the same user (handle_consent_yes).
+            async with self.data_manager.user_lock(user.id):
+                saved = await self.data_manager.asave_user_data(user.id, user_data)
+            
+            if saved:
                 # Remove the contact sharing keyboard by sending a message with remove_keyboard
                 from telegram import ReplyKeyboardRemove
                 await update.message.reply_text(
@@ -1,30 +1,69 @@
 import logging
+import threading
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from config import KEYWORD_PDF_MAPPING, BUTTONS
+from config import KEYWORD_PDF_MAPPING, KEYWORD_MATCHING, BUTTONS, FILES
+from file_watcher import FileWatcher
+from keyword_matcher import create_matcher, load_mapping
 from pdf_handler import PDFHandler
 
 logger = logging.getLogger(__name__)
 
+# Most documents Telegram accepts in one media group
+MEDIA_GROUP_LIMIT = 10
+
 class KeywordHandler:
-    def __init__(self):
-        """Initialize keyword handler with PDF handler"""
-        self.pdf_handler = PDFHandler()
+    def __init__(self, pdf_handler=None, analytics=None):
+        """Initialize keyword handler with PDF handler and optional KeywordAnalytics"""
+        self.pdf_handler = pdf_handler or PDFHandler()
+        self.analytics = analytics
+        self.keywords_file = FILES["keywords"]
+        # Replaced as a whole when the keywords file changes, never modified in place
+        self.matcher = None
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        if not self.reload_keywords():
+            self.matcher = create_matcher(KEYWORD_PDF_MAPPING, KEYWORD_MATCHING)
+    
+    def reload_keywords(self):
+        """Build a matcher from the keywords file and swap it in, return True on success
+
+        The new matcher is built completely before it replaces the old one,
+        so messages are matched against one or the other, never a mix. If
+        the file cannot be read the current matcher stays in use.
+        """
+        with self._reload_lock:
+            try:
+                mapping = load_mapping(self.keywords_file, KEYWORD_PDF_MAPPING)
+                matcher = create_matcher(mapping, KEYWORD_MATCHING)
+            except Exception as e:
+                logger.error(f"Error loading keywords from {self.keywords_file}: {e}")
+                return False
+            self.matcher = matcher
+        logger.info(f"Loaded {len(mapping)} keywords")
+        return True
+    
+    def start_watching(self, poll_interval=KEYWORD_MATCHING["watch_interval"]):
+        """Reload keywords in a background thread whenever the keywords file changes"""
+        if self._watcher is not None:
+            return
+        self._watcher = FileWatcher([self.keywords_file], self.reload_keywords, poll_interval=poll_interval, name="keywords-watcher")
+        self._watcher.start()
+    
+    def stop_watching(self):
+        """Stop the background file watcher"""
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
     
     def check_message_for_keywords(self, message_text: str) -> list:
         """Check if message contains any keywords and return matching PDFs"""
         if not message_text:
             return []
         
-        message_lower = message_text.lower()
-        matching_pdfs = []
-        
-        for keyword, pdf_filename in KEYWORD_PDF_MAPPING.items():
-            if keyword.lower() in message_lower:
-                matching_pdfs.append(pdf_filename)
-        
-        # Remove duplicates while preserving order
-        return list(dict.fromkeys(matching_pdfs))
+        # PDFs in mapping order, without duplicates
+        return self.matcher.match(message_text)
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle incoming message and check for keywords"""
@@ -33,23 +72,26 @@ class KeywordHandler:
         if not message_text:
             return False
         
-        matching_pdfs = self.check_message_for_keywords(message_text)
+        keywords, matching_pdfs = self.matcher.match_keywords(message_text)
+        if self.analytics is not None:
+            self.analytics.record_message(keywords)
         
         if not matching_pdfs:
             return False
         
         # Send matching PDFs
-        for pdf_filename in matching_pdfs:
-            await self.send_keyword_pdf(update, context, pdf_filename)
+        if len(matching_pdfs) == 1:
+            await self.send_keyword_pdf(update, context, matching_pdfs[0])
+        else:
+            await self.send_keyword_pdfs(update, context, matching_pdfs)
         
         return True
     
     async def send_keyword_pdf(self, update: Update, context: ContextTypes.DEFAULT_TYPE, filename: str):
         """Send PDF file based on keyword match"""
         try:
-            pdf_path = self.pdf_handler.get_pdf_path(filename)
-            
             if not self.pdf_handler.pdf_exists(filename):
+                self._record_send(filename)
                 await update.message.reply_text(
                     f"❌ Файл {filename} не найден.\n"
                     "Пожалуйста, убедитесь, что PDF файл существует в директории pdfs."
@@ -62,21 +104,88 @@ class KeywordHandler:
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            with open(pdf_path, 'rb') as pdf_file:
-                await context.bot.send_document(
-                    chat_id=update.message.chat_id,
-                    document=pdf_file,
-                    filename=filename,
-                    caption=f"📄 Вот PDF файл, связанный с вашим запросом: {filename}",
-                    reply_markup=reply_markup
-                )
+            started = time.perf_counter()
+            await self.pdf_handler.send_document(
+                context.bot,
+                update.message.chat_id,
+                filename,
+                caption=f"📄 Вот PDF файл, связанный с вашим запросом: {filename}",
+                reply_markup=reply_markup
+            )
+            self._record_send(filename, time.perf_counter() - started)
             
             logger.info(f"Keyword-triggered PDF {filename} sent to user {update.message.from_user.id}")
             return True
-            
+        
         except Exception as e:
+            self._record_send(filename)
             logger.error(f"Error sending keyword PDF {filename}: {e}")
             await update.message.reply_text(
                 f"❌ Ошибка при отправке {filename}. Пожалуйста, попробуйте позже."
             )
-            return False 
\ No newline at end of file
+            return False
+    
+    async def send_keyword_pdfs(self, update: Update, context: ContextTypes.DEFAULT_TYPE, filenames: list):
+        """Send several PDFs as media groups, then the main menu button in a follow-up message
+
+        Media groups cannot carry a keyboard, hence the extra message; still
+        two requests instead of one per document.
+        """
+        available = []
+        for filename in filenames:
+            if self.pdf_handler.pdf_exists(filename):
+                available.append(filename)
+            else:
+                self._record_send(filename)
+                await update.message.reply_text(
+                    f"❌ Файл {filename} не найден.\n"
+                    "Пожалуйста, убедитесь, что PDF файл существует в директории pdfs."
+                )
+        if not available:
+            return False
+        
+        for start in range(0, len(available), MEDIA_GROUP_LIMIT):
+            chunk = available[start:start + MEDIA_GROUP_LIMIT]
+            try:
+                started = time.perf_counter()
+                if len(chunk) == 1:
+                    # A media group needs at least two documents
+                    await self.pdf_handler.send_document(
+                        context.bot,
+                        update.message.chat_id,
+                        chunk[0],
+                        caption=f"📄 Вот PDF файл, связанный с вашим запросом: {chunk[0]}"
+                    )
+                else:
+                    await self.pdf_handler.send_media_group(
+                        context.bot,
+                        update.message.chat_id,
+                        chunk,
+                        [f"📄 {filename}" for filename in chunk]
+                    )
+                elapsed = time.perf_counter() - started
+            except Exception as e:
+                for filename in available[start:]:
+                    self._record_send(filename)
+                logger.error(f"Error sending keyword PDFs {', '.join(chunk)}: {e}")
+                await update.message.reply_text(
+                    f"❌ Ошибка при отправке {', '.join(available[start:])}. Пожалуйста, попробуйте позже."
+                )
+                return False
+            for filename in chunk:
+                self._record_send(filename, elapsed)
+        
+        keyboard = [
+            [InlineKeyboardButton(BUTTONS["main_menu"], callback_data="back_to_start")]
+        ]
+        await update.message.reply_text(
+            "📄 Вот PDF файлы, связанные с вашим запросом.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        
+        logger.info(f"Keyword-triggered PDFs {', '.join(available)} sent to user {update.message.from_user.id}")
+        return True
+    
+    def _record_send(self, filename, seconds=None):
+        if self.analytics is not None:
+            self.analytics.record_send(filename, seconds)
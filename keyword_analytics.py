@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from latency_histogram import LatencyHistogram
+from storage.atomic_file import write_atomic
+from storage.file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the send latency histogram buckets, one more bucket holds slower sends
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class DocumentStats(LatencyHistogram):
+    """Send counters and latency histogram of one document"""
+    
+    __slots__ = ("failed",)
+    
+    def __init__(self):
+        super().__init__(LATENCY_BUCKETS_MS)
+        self.failed = 0
+    
+    @property
+    def sent(self):
+        return self.count
+    
+    def merge(self, other):
+        super().merge(other)
+        self.failed += other.failed
+    
+    def to_list(self):
+        return [self.count, self.failed, round(self.total_ms, 1), round(self.max_ms, 1), self.buckets]
+    
+    @classmethod
+    def from_list(cls, values):
+        stats = cls()
+        stats.count, stats.failed, stats.total_ms, stats.max_ms, buckets = values
+        if len(buckets) == len(stats.buckets):
+            stats.buckets = list(buckets)
+        return stats
+
+class KeywordCounters:
+    """Counts of messages, keyword hits, misses and document sends"""
+    
+    def __init__(self):
+        self.messages = 0
+        self.misses = 0
+        self.keywords = Counter()
+        self.documents = {}
+    
+    def __bool__(self):
+        return bool(self.messages or self.documents)
+    
+    def document(self, filename):
+        stats = self.documents.get(filename)
+        if stats is None:
+            stats = self.documents[filename] = DocumentStats()
+        return stats
+    
+    def merge(self, other):
+        self.messages += other.messages
+        self.misses += other.misses
+        self.keywords.update(other.keywords)
+        for filename, stats in other.documents.items():
+            self.document(filename).merge(stats)
+    
+    def to_dict(self):
+        return {
+            "messages": self.messages,
+            "misses": self.misses,
+            "keywords": dict(self.keywords),
+            "documents": {filename: stats.to_list() for filename, stats in self.documents.items()}
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        counters = cls()
+        counters.messages = data.get("messages", 0)
+        counters.misses = data.get("misses", 0)
+        counters.keywords.update(data.get("keywords", {}))
+        for filename, values in data.get("documents", {}).items():
+            counters.documents[filename] = DocumentStats.from_list(values)
+        return counters
+
+class KeywordAnalytics:
+    """In-process counters of keyword hits, misses and document sends
+
+    Recording only bumps in-memory counters, the file is written by a
+    background thread every flush_interval seconds. Each flush adds the
+    counts since the previous one to the file, so totals survive restarts
+    and several bot processes can share one file.
+    """
+    
+    def __init__(self, filename, flush_interval=60.0):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        # Only guards swapping _pending, never held during file I/O
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(f"{filename}.lock")
+        self._pending = KeywordCounters()
+        # Counts being written by flush, still part of the totals meanwhile
+        self._flushing = None
+        self._totals = KeywordCounters()
+        self._stop_event = threading.Event()
+        self._thread = None
+        try:
+            self._totals = self._read()
+        except Exception as e:
+            logger.error(f"Error reading keyword statistics from {filename}: {e}")
+    
+    def record_message(self, keywords):
+        """Count a message and the keywords found in it (none is a miss)"""
+        with self._lock:
+            pending = self._pending
+            pending.messages += 1
+            if not keywords:
+                pending.misses += 1
+            for keyword in keywords:
+                pending.keywords[keyword] += 1
+    
+    def record_send(self, filename, seconds=None):
+        """Count a document sent in the given time, or a failed send without one"""
+        with self._lock:
+            stats = self._pending.document(filename)
+            if seconds is None:
+                stats.failed += 1
+            else:
+                stats.add(seconds * 1000)
+    
+    def snapshot(self):
+        """Totals including the counts not flushed yet"""
+        counters = KeywordCounters()
+        with self._lock:
+            counters.merge(self._totals)
+            if self._flushing is not None:
+                counters.merge(self._flushing)
+            counters.merge(self._pending)
+        return counters
+    
+    def start(self):
+        """Start flushing in a background thread"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="keyword-stats", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop the background thread and write the remaining counts"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+    
+    def flush(self):
+        """Add the counts since the last flush to the file"""
+        with self._lock:
+            pending = self._pending
+            if not pending:
+                return
+            self._pending = KeywordCounters()
+            self._flushing = pending
+        try:
+            with self._file_lock:
+                totals = self._read()
+                totals.merge(pending)
+                self._write(totals)
+        except Exception as e:
+            logger.error(f"Error writing keyword statistics to {self.filename}: {e}")
+            with self._lock:
+                self._pending.merge(pending)
+                self._flushing = None
+            return
+        with self._lock:
+            self._totals = totals
+            self._flushing = None
+    
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+    
+    def _read(self):
+        if not os.path.exists(self.filename):
+            return KeywordCounters()
+        with open(self.filename, encoding='utf-8') as f:
+            return KeywordCounters.from_dict(json.load(f))
+    
+    def _write(self, counters):
+        write_atomic(self.filename, json.dumps(counters.to_dict(), ensure_ascii=False, separators=(",", ":")))
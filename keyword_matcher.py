@@ -0,0 +1,297 @@
+import json
+import os
+from collections import deque
+from stemmer import stem, tokenize
+
+# Misspelled words looked up recently, per matcher
+FUZZY_CACHE_SIZE = 10000
+
+# Shorter stems of keywords are not indexed, they are shared by unrelated words ("аудит" -> "ауд" <- "аудио")
+MIN_STEM_LENGTH = 4
+
+def create_matcher(mapping, settings):
+    """Create the keyword matcher selected by KEYWORD_MATCHING settings in config"""
+    mode = settings.get("mode", "stem")
+    if mode == "stem":
+        return StemMatcher(
+            mapping,
+            fuzzy=settings.get("fuzzy", False),
+            fuzzy_max_distance=settings.get("fuzzy_max_distance", 2),
+            fuzzy_chars_per_typo=settings.get("fuzzy_chars_per_typo", 6)
+        )
+    if mode == "substring":
+        return KeywordMatcher(mapping)
+    raise ValueError(f"Unknown keyword matching mode: {mode}")
+
+def load_mapping(filename, default):
+    """Read a {keyword: filename} mapping from a JSON file, default if there is no file
+
+    Raises ValueError if the file is not a JSON object of strings, so a
+    half-written file is never taken for an empty mapping.
+    """
+    if not os.path.exists(filename):
+        return dict(default)
+    with open(filename, encoding="utf-8") as f:
+        mapping = json.load(f)
+    if not isinstance(mapping, dict) or not all(
+        isinstance(keyword, str) and isinstance(value, str) for keyword, value in mapping.items()
+    ):
+        raise ValueError(f"{filename} must map keywords to file names")
+    return mapping
+
+def edit_distance(a, b):
+    """Edit distance of two strings, swapping two adjacent letters counts as one typo
+
+    (Levenshtein distance plus transpositions, "optimal string alignment")
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            distance = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            )
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                distance = min(distance, before_previous[j - 2] + 1)
+            current.append(distance)
+        before_previous, previous = previous, current
+    return previous[-1]
+
+def _deletions(word, depth):
+    """All strings made by deleting up to depth characters from word"""
+    found = layer = {word}
+    for _ in range(depth):
+        layer = {variant[:i] + variant[i + 1:] for variant in layer for i in range(len(variant))}
+        found = found | layer
+    return found
+
+class TypoIndex:
+    """Finds words within a small edit distance of a misspelled word
+
+    Two words within edit distance k become equal after deleting at most k
+    characters from each, so every word is stored under its deletion
+    variants. A lookup reads the words stored under the variants of the
+    query and checks only those with edit_distance, so its cost depends on
+    the length of the query rather than on the number of words.
+    """
+    
+    def __init__(self):
+        # Deletion variant -> words having it
+        self._words = {}
+    
+    def add(self, word, max_distance):
+        """Make word findable from misspellings with up to max_distance typos"""
+        for variant in _deletions(word, max_distance):
+            self._words.setdefault(variant, []).append(word)
+    
+    def search(self, word, max_distance):
+        """Return (distance, word) of the added words within max_distance"""
+        candidates = set()
+        for variant in _deletions(word, max_distance):
+            candidates.update(self._words.get(variant, ()))
+        results = []
+        for candidate in candidates:
+            if abs(len(candidate) - len(word)) <= max_distance:
+                distance = edit_distance(word, candidate)
+                if distance <= max_distance:
+                    results.append((distance, candidate))
+        return results
+
+class Matcher:
+    """Base class of keyword matchers"""
+    
+    def find(self, text):
+        """Return indices of the keywords found in text, in mapping order"""
+        raise NotImplementedError
+    
+    def match(self, text):
+        """Return values of the keywords found in text
+
+        Values are ordered by the first matching keyword in the mapping and
+        have no duplicates.
+        """
+        return self.match_keywords(text)[1]
+    
+    def match_keywords(self, text):
+        """Return the keywords found in text and their values as in match"""
+        indices = self.find(text)
+        keywords = [self.keywords[index] for index in indices]
+        return keywords, list(dict.fromkeys(self.values[index] for index in indices))
+
+class KeywordMatcher(Matcher):
+    """Finds all keywords of a mapping in a text in one pass
+
+    Builds an Aho-Corasick automaton from the keywords once, so matching
+    costs O(text length + matches) no matter how many keywords there are.
+    Matching is case-insensitive (str.lower) and works on substrings,
+    like `keyword.lower() in text.lower()`.
+    """
+    
+    def __init__(self, mapping):
+        """Compile the automaton from a {keyword: value} mapping"""
+        self.keywords = list(mapping)
+        self.values = list(mapping.values())
+        # Per state: transitions, failure link and indices of keywords ending there
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        # Empty keywords are contained in every text
+        self._always = []
+        
+        for index, keyword in enumerate(mapping):
+            keyword = keyword.lower()
+            if not keyword:
+                self._always.append(index)
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                state = next_state
+            self._output[state] += (index,)
+        
+        self._build_failure_links()
+    
+    def _build_failure_links(self):
+        """Set failure links breadth-first and merge outputs along them"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                if self._output[fail]:
+                    self._output[next_state] += self._output[fail]
+    
+    def find(self, text):
+        if not text:
+            return []
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found = set(self._always)
+        root = goto[0]
+        state = 0
+        for char in text.lower():
+            if state:
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+            else:
+                # Most characters of a message start no keyword at all
+                state = root.get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return sorted(found)
+
+class StemMatcher(Matcher):
+    """Finds keywords in a text by the stems of its words
+
+    The text is split into words and each word is stemmed, so any form of
+    a keyword matches ("продукта" finds "продукт") while parts of longer
+    words do not. Each word costs one lookup in a stem index built once.
+    Keywords of several words match the same words in a row.
+
+    A word matches a keyword only if it is at least as long as the
+    keyword, so shorter words cut to the same stem ("перва" for "первый")
+    do not count.
+
+    With fuzzy enabled, a word without an exact hit is compared as written
+    with the keywords as written and matches the closest ones within one
+    typo per fuzzy_chars_per_typo letters of both words (at most
+    fuzzy_max_distance), so "процесы" still finds "процессы". Shorter words
+    must match exactly: most short words are one typo away from some
+    keyword ("fine" from "file").
+    """
+    
+    def __init__(self, mapping, fuzzy=False, fuzzy_max_distance=2, fuzzy_chars_per_typo=6):
+        """Build the stem index from a {keyword: value} mapping"""
+        self.keywords = list(mapping)
+        self.values = list(mapping.values())
+        self.fuzzy = fuzzy
+        self.fuzzy_max_distance = fuzzy_max_distance
+        self.fuzzy_chars_per_typo = fuzzy_chars_per_typo
+        # First stem of a keyword -> [(stems of the remaining words, keyword index, shortest first word)]
+        self.index = {}
+        for index, keyword in enumerate(mapping):
+            words = tokenize(keyword)
+            if not words:
+                continue
+            rest = tuple(stem(word) for word in words[1:])
+            # The stemmer sometimes cuts a base form shorter than its other forms
+            # ("аудит" -> "ауд", "аудита" -> "аудит"), so the word itself is
+            # indexed as well
+            first_stem = stem(words[0])
+            for first in dict.fromkeys((first_stem, words[0])):
+                if first is first_stem and len(first) < MIN_STEM_LENGTH and first != words[0]:
+                    continue
+                self.index.setdefault(first, []).append((rest, index, len(words[0])))
+        self._typos = TypoIndex()
+        self._fuzzy_cache = {}
+        if fuzzy:
+            # Stems are too short to tell typos from other words, so only
+            # the words as written are used ("професс" is one typo from "процесс")
+            for keyword in mapping:
+                words = tokenize(keyword)
+                if words:
+                    self._typos.add(words[0], self._max_typos(len(words[0])))
+    
+    def find(self, text):
+        if not text:
+            return []
+        words = tokenize(text)
+        stems = [stem(word) for word in words]
+        found = set()
+        for position, word_stem in enumerate(stems):
+            # Short keyword stems are only indexed as written ("аудит")
+            entries = self.index.get(word_stem) or self.index.get(words[position])
+            shortest = len(words[position])
+            if entries is None and self.fuzzy:
+                entries = self._find_fuzzy(words[position])
+                # Typos may shorten the word, their count is limited instead
+                shortest = None
+            for rest, index, length in entries or ():
+                if shortest is not None and shortest < length:
+                    continue
+                if not rest or tuple(stems[position + 1:position + 1 + len(rest)]) == rest:
+                    found.add(index)
+        return sorted(found)
+    
+    def _max_typos(self, length):
+        """Typos tolerated in a word of this length"""
+        return min(self.fuzzy_max_distance, length // self.fuzzy_chars_per_typo)
+    
+    def _find_fuzzy(self, word):
+        """Index entries of the closest keywords within the allowed typos"""
+        max_distance = self._max_typos(len(word))
+        if max_distance == 0:
+            return ()
+        entries = self._fuzzy_cache.get(word)
+        if entries is None:
+            # The keyword must be long enough for the typos as well
+            matches = [(distance, key) for distance, key in self._typos.search(word, max_distance)
+                       if distance <= self._max_typos(len(key))]
+            entries = []
+            if matches:
+                closest = min(distance for distance, _ in matches)
+                for distance, key in sorted(matches):
+                    if distance == closest:
+                        entries.extend(self.index[key])
+            if len(self._fuzzy_cache) >= FUZZY_CACHE_SIZE:
+                self._fuzzy_cache.clear()
+            self._fuzzy_cache[word] = entries
+        return entries
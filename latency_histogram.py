@@ -0,0 +1,45 @@
+from bisect import bisect_left
+
+class LatencyHistogram:
+    """Count, total, maximum and bucket histogram of latencies in ms
+
+    bounds are the upper bounds (ms) of the buckets, one more bucket holds
+    longer latencies. Percentiles are read from the buckets, so they are
+    as precise as the bounds.
+    """
+    
+    __slots__ = ("bounds", "count", "total_ms", "max_ms", "buckets")
+    
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(bounds) + 1)
+    
+    def add(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        self.buckets[bisect_left(self.bounds, ms)] += 1
+    
+    def merge(self, other):
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+        for i, count in enumerate(other.buckets):
+            self.buckets[i] += count
+    
+    def average_ms(self):
+        return self.total_ms / self.count if self.count else 0.0
+    
+    def percentile_ms(self, fraction):
+        """Upper bound of the bucket holding the given fraction of latencies"""
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
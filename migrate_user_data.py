@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Script to import user_data.json (and its journal) into the SQLite database
+"""
+
+import argparse
+import time
+from config import FILES, STORAGE
+from storage.json_storage import JsonStorage
+from storage.sqlite_storage import SQLiteStorage
+
+def migrate(json_filename, db_filename, journal_filename):
+    """Copy all records from the JSON store into the SQLite store"""
+    source = JsonStorage(json_filename, mode="journal", journal_filename=journal_filename)
+    target = SQLiteStorage(db_filename)
+    
+    started = time.monotonic()
+    print(f"Reading {json_filename}...")
+    total = source.load()
+    print(f"Importing {total} user records into {db_filename}...")
+    
+    target.load()
+    imported = target.put_many(source.items())
+    stored = target.count()
+    target.close()
+    source.close()
+    
+    print(f"✅ Imported {imported} user records in {time.monotonic() - started:.2f}s")
+    print(f"📊 Users in database: {stored}")
+    print("Set STORAGE[\"mode\"] = \"sqlite\" in config.py to use the database")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--json", default=FILES["user_data"], help="JSON file to import")
+    parser.add_argument("--journal", default=STORAGE["journal"], help="Journal of the JSON file")
+    parser.add_argument("--db", default=FILES["user_db"], help="SQLite database to import into")
+    args = parser.parse_args()
+    migrate(args.json, args.db, args.journal)
@@ -2,14 +2,26 @@ import os
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
+from config import FILES, DOCUMENT_CACHE
+from document_catalog import DocumentCatalog
+from file_id_cache import DocumentBytesCache, FileIdCache
 
 logger = logging.getLogger(__name__)
 
 class PDFHandler:
-    def __init__(self, pdf_directory="pdfs"):
+    def __init__(self, pdf_directory="pdfs", file_id_cache=None, catalog=None):
         """Initialize PDF handler with directory for PDF files"""
         self.pdf_directory = pdf_directory
         self.ensure_pdf_directory()
+        # PDFs and the brief indexed in memory, see start_watching
+        self.catalog = catalog or DocumentCatalog(pdf_directory, [FILES["brief"]])
+        # Documents are uploaded once and resent by Telegram file_id,
+        # uploads of small documents come from memory
+        self.file_id_cache = file_id_cache or FileIdCache(
+            FILES["file_ids"],
+            self.catalog,
+            DocumentBytesCache(DOCUMENT_CACHE["max_bytes"], DOCUMENT_CACHE["max_file_size"], self.catalog)
+        )
     
     def ensure_pdf_directory(self):
         """Create PDF directory if it doesn't exist"""
@@ -23,13 +35,35 @@ class PDFHandler:
     
     def pdf_exists(self, filename):
         """Check if PDF file exists"""
-        return os.path.exists(self.get_pdf_path(filename))
+        return self.get_pdf_path(filename) in self.catalog
+    
+    def start_watching(self):
+        """Keep the document catalog up to date in a background thread"""
+        self.catalog.start_watching()
+    
+    def stop_watching(self):
+        """Stop the background file watcher"""
+        self.catalog.stop_watching()
+    
+    async def send_document(self, bot, chat_id, filename, **kwargs):
+        """Send a PDF from the directory, by cached file_id when possible"""
+        return await self.file_id_cache.send_document(bot, chat_id, self.get_pdf_path(filename), filename=filename, **kwargs)
+    
+    async def send_media_group(self, bot, chat_id, filenames, captions):
+        """Send up to 10 PDFs from the directory in one request"""
+        documents = [(self.get_pdf_path(filename), filename, caption) for filename, caption in zip(filenames, captions)]
+        return await self.file_id_cache.send_media_group(bot, chat_id, documents)
+    
+    async def prewarm(self, bot, chat_id, concurrency):
+        """Upload all PDFs and the brief to a chat so their file_ids are cached"""
+        documents = [(self.get_pdf_path(filename), filename) for filename in self.list_available_pdfs()]
+        if FILES["brief"] in self.catalog:
+            documents.append((FILES["brief"], FILES["brief"]))
+        await self.file_id_cache.prewarm(bot, chat_id, documents, concurrency)
     
     async def send_pdf(self, update: Update, context: ContextTypes.DEFAULT_TYPE, filename):
         """Send PDF file to user"""
         try:
-            pdf_path = self.get_pdf_path(filename)
-            
             if not self.pdf_exists(filename):
                 await update.callback_query.edit_message_text(
                     f"❌ File {filename} not found.\n\n"
@@ -43,14 +77,13 @@ class PDFHandler:
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            with open(pdf_path, 'rb') as pdf_file:
-                await context.bot.send_document(
-                    chat_id=update.callback_query.from_user.id,
-                    document=pdf_file,
-                    filename=filename,
-                    caption=f"📄 Держите {filename}",
-                    reply_markup=reply_markup
-                )
+            await self.send_document(
+                context.bot,
+                update.callback_query.from_user.id,
+                filename,
+                caption=f"📄 Держите {filename}",
+                reply_markup=reply_markup
+            )
             
             # Update the original message to show success
             await update.callback_query.edit_message_text(
@@ -59,7 +92,7 @@ class PDFHandler:
             
             logger.info(f"PDF {filename} sent to user {update.callback_query.from_user.id}")
             return True
-            
+        
         except Exception as e:
             logger.error(f"Error sending PDF {filename}: {e}")
             await update.callback_query.edit_message_text(
@@ -69,12 +102,4 @@ class PDFHandler:
     
     def list_available_pdfs(self):
         """List all available PDF files in the directory"""
-        if not os.path.exists(self.pdf_directory):
-            return []
-        
-        pdf_files = []
-        for file in os.listdir(self.pdf_directory):
-            if file.lower().endswith('.pdf'):
-                pdf_files.append(file)
-        
-        return pdf_files 
\ No newline at end of file
+        return [file for file in self.catalog.directory_files() if file.lower().endswith('.pdf')] 
\ No newline at end of file
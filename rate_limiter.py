@@ -0,0 +1,219 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from latency_histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Lower value goes first: a user waiting on a button press before document uploads,
+# anything nobody is waiting on (broadcasts) last
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BULK = 2
+PRIORITY_BACKGROUND = 3
+PRIORITY_NAMES = ("interactive", "default", "bulk", "background")
+
+INTERACTIVE_ENDPOINTS = {
+    "answerCallbackQuery",
+    "editMessageText",
+    "editMessageReplyMarkup",
+    "editMessageCaption",
+    "deleteMessage",
+}
+BULK_ENDPOINTS = {"sendDocument", "sendMediaGroup"}
+
+# Upper bounds (ms) of the queue wait histogram buckets, one more bucket holds longer waits
+WAIT_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Idle per-chat buckets are dropped this often (seconds)
+PRUNE_INTERVAL = 60.0
+
+class TokenBucket:
+    """Up to capacity tokens, refilled at rate tokens per second"""
+    
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+    
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+    
+    def wait_time(self, now):
+        """Seconds until a token is available"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def take(self):
+        self.tokens -= 1
+    
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+class _Request:
+    __slots__ = ("priority", "chat_id", "queued_at", "granted")
+    
+    def __init__(self, priority, chat_id, queued_at, granted):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.queued_at = queued_at
+        self.granted = granted
+
+def _priority(endpoint, rate_limit_args):
+    if isinstance(rate_limit_args, dict) and "priority" in rate_limit_args:
+        return min(max(rate_limit_args["priority"], PRIORITY_INTERACTIVE), PRIORITY_BACKGROUND)
+    if endpoint in INTERACTIVE_ENDPOINTS:
+        return PRIORITY_INTERACTIVE
+    if endpoint in BULK_ENDPOINTS:
+        return PRIORITY_BULK
+    return PRIORITY_DEFAULT
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """Schedules all Bot API requests under Telegram's flood limits
+
+    A request waits for a token of the global bucket and, if it is sent to
+    a chat, of that chat's bucket (groups have their own, slower limit).
+    Waiting requests get tokens by priority: interactive replies
+    (answerCallbackQuery, editMessageText, ...) before other requests,
+    document uploads last; rate_limit_args={"priority": n} overrides it.
+    On RetryAfter all requests are paused for the given time and the
+    request is retried up to max_retries times.
+    """
+    
+    def __init__(self, settings):
+        self.settings = settings
+        self._global = None
+        self._chats = {}
+        # (priority, sequence, request) of requests waiting for tokens
+        self._queue = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._pruned_at = 0.0
+        self._dispatcher = None
+        # Queue waits by priority
+        self.waits = [LatencyHistogram(WAIT_BUCKETS_MS) for _ in PRIORITY_NAMES]
+        self.retry_after = 0
+    
+    async def initialize(self):
+        loop = asyncio.get_running_loop()
+        self._global = TokenBucket(self.settings["global_rate"], self.settings["global_burst"], loop.time())
+        self._pruned_at = loop.time()
+        self._dispatcher = loop.create_task(self._dispatch())
+    
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+    
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = _priority(endpoint, rate_limit_args)
+        chat_id = data.get("chat_id")
+        retries = 0
+        while True:
+            await self._acquire(priority, chat_id)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after += 1
+                loop = asyncio.get_running_loop()
+                self._paused_until = max(self._paused_until, loop.time() + e.retry_after)
+                self._wakeup.set()
+                if retries >= self.settings["max_retries"]:
+                    raise
+                retries += 1
+                logger.warning(f"Flood limit hit on {endpoint}, pausing requests for {e.retry_after}s (retry {retries})")
+    
+    async def _acquire(self, priority, chat_id):
+        loop = asyncio.get_running_loop()
+        request = _Request(priority, chat_id, loop.time(), loop.create_future())
+        heapq.heappush(self._queue, (priority, next(self._sequence), request))
+        self._wakeup.set()
+        try:
+            await request.granted
+        except asyncio.CancelledError:
+            # Still queued: the dispatcher skips it. Already granted: the token is spent.
+            request.granted.cancel()
+            raise
+        wait_ms = (loop.time() - request.queued_at) * 1000
+        self.waits[priority].add(wait_ms)
+    
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.settings["group_rate"], self.settings["group_burst"], now)
+            else:
+                bucket = TokenBucket(self.settings["chat_rate"], self.settings["chat_burst"], now)
+            self._chats[chat_id] = bucket
+        return bucket
+    
+    async def _dispatch(self):
+        """Hand out tokens to waiting requests in priority order"""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            timeout = None
+            if now < self._paused_until:
+                timeout = self._paused_until - now
+            elif self._queue:
+                timeout = self._grant(now)
+            if now - self._pruned_at >= PRUNE_INTERVAL:
+                self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items() if not bucket.is_full(now)}
+                self._pruned_at = now
+            if timeout == 0.0:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    def _grant(self, now):
+        """Grant tokens while possible, returns the seconds until the next grant (None if nothing waits)"""
+        global_wait = self._global.wait_time(now)
+        if global_wait > 0:
+            return global_wait
+        # Requests whose chat is out of tokens step aside for later requests of other chats
+        blocked = []
+        chat_wait = None
+        granted = False
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            request = entry[2]
+            if request.granted.done():
+                continue
+            bucket = None
+            if request.chat_id is not None:
+                bucket = self._chat_bucket(request.chat_id, now)
+                wait = bucket.wait_time(now)
+                if wait > 0:
+                    blocked.append(entry)
+                    chat_wait = wait if chat_wait is None else min(chat_wait, wait)
+                    continue
+                bucket.take()
+            self._global.take()
+            request.granted.set_result(None)
+            granted = True
+            break
+        for entry in blocked:
+            heapq.heappush(self._queue, entry)
+        if granted:
+            return 0.0
+        return chat_wait
+    
+    def queue_depth(self):
+        """Number of waiting requests by priority name"""
+        depth = [0] * len(PRIORITY_NAMES)
+        for priority, _, request in self._queue:
+            if not request.granted.done():
+                depth[priority] += 1
+        return dict(zip(PRIORITY_NAMES, depth))
@@ -0,0 +1,141 @@
+import re
+from functools import lru_cache
+
+# Lightweight stemmers for keyword matching: the Snowball algorithm for
+# Russian and plural/verb suffix stripping for English. The same function
+# stems keywords and message words, so only consistency matters, not
+# linguistic perfection.
+
+WORD_PATTERN = re.compile(r"\w+")
+
+RUSSIAN_VOWELS = "аеиоуыэюя"
+
+def _endings(*endings):
+    """Set of endings with the length of the longest one"""
+    return frozenset(endings), max(len(ending) for ending in endings)
+
+# Snowball endings; group 1 endings must follow "а" or "я"
+PERFECTIVE_GERUND_1 = _endings("в", "вши", "вшись")
+PERFECTIVE_GERUND_2 = _endings("ив", "ивши", "ившись", "ыв", "ывши", "ывшись")
+ADJECTIVE = _endings("ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый", "ой", "ем", "им", "ым",
+                     "ом", "его", "ого", "ему", "ому", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею")
+PARTICIPLE_1 = _endings("ем", "нн", "вш", "ющ", "щ")
+PARTICIPLE_2 = _endings("ивш", "ывш", "ующ")
+REFLEXIVE = _endings("ся", "сь")
+VERB_1 = _endings("ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но", "ет", "ют", "ны",
+                  "ть", "ешь", "нно")
+VERB_2 = _endings("ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей", "уй", "ил", "ыл",
+                  "им", "ым", "ен", "ило", "ыло", "ено", "ят", "ует", "уют", "ит", "ыт", "ены", "ить",
+                  "ыть", "ишь", "ую", "ю")
+NOUN = _endings("а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи", "ии", "и", "ией", "ей",
+                "ой", "ий", "й", "иям", "ям", "ием", "ем", "ам", "ом", "о", "у", "ах", "иях", "ях", "ы",
+                "ь", "ию", "ью", "ю", "ия", "ья", "я")
+SUPERLATIVE = _endings("ейш", "ейше")
+DERIVATIONAL = _endings("ост", "ость")
+
+def tokenize(text):
+    """Split text into lower-cased words"""
+    return WORD_PATTERN.findall(text.lower())
+
+@lru_cache(maxsize=100000)
+def stem(word):
+    """Stem a lower-cased word, Russian or English by its letters"""
+    if any("а" <= char <= "я" or char == "ё" for char in word):
+        return stem_russian(word)
+    if word.isascii() and word.isalpha():
+        return stem_english(word)
+    return word
+
+def _regions(word):
+    """Start of RV and R2 of a Russian word (see the Snowball description)"""
+    rv = r1 = r2 = len(word)
+    for i, char in enumerate(word):
+        if char in RUSSIAN_VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in RUSSIAN_VOWELS and word[i - 1] in RUSSIAN_VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in RUSSIAN_VOWELS and word[i - 1] in RUSSIAN_VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+def _strip(word, start, endings, preceded_by_a=False):
+    """Remove the longest of endings found at or after start, return None if there is none"""
+    endings, longest = endings
+    for length in range(min(longest, len(word) - start), 0, -1):
+        if word[-length:] in endings:
+            break
+    else:
+        return None
+    position = len(word) - length
+    if preceded_by_a and not (position - 1 >= start and word[position - 1] in "ая"):
+        return None
+    return word[:position]
+
+def _strip_groups(word, start, group_1, group_2):
+    """Remove the longest ending of either group, group 1 endings only after "а"/"я" """
+    longest_1 = _strip(word, start, group_1)
+    longest_2 = _strip(word, start, group_2)
+    if longest_1 is not None and (longest_2 is None or len(longest_1) < len(longest_2)):
+        return _strip(word, start, group_1, preceded_by_a=True)
+    return longest_2
+
+def stem_russian(word):
+    """Snowball Russian stemmer"""
+    word = word.replace("ё", "е")
+    rv, r2 = _regions(word)
+    
+    # Step 1
+    stripped = _strip_groups(word, rv, PERFECTIVE_GERUND_1, PERFECTIVE_GERUND_2)
+    if stripped is not None:
+        word = stripped
+    else:
+        word = _strip(word, rv, REFLEXIVE) or word
+        stripped = _strip(word, rv, ADJECTIVE)
+        if stripped is not None:
+            word = _strip_groups(stripped, rv, PARTICIPLE_1, PARTICIPLE_2) or stripped
+        else:
+            stripped = _strip_groups(word, rv, VERB_1, VERB_2)
+            if stripped is None:
+                stripped = _strip(word, rv, NOUN)
+            if stripped is not None:
+                word = stripped
+    
+    # Step 2
+    if word.endswith("и") and len(word) - 1 >= rv:
+        word = word[:-1]
+    
+    # Step 3
+    word = _strip(word, r2, DERIVATIONAL) or word
+    
+    # Step 4
+    if word.endswith("нн") and len(word) - 2 >= rv:
+        word = word[:-1]
+    else:
+        stripped = _strip(word, rv, SUPERLATIVE)
+        if stripped is not None:
+            word = stripped
+            if word.endswith("нн") and len(word) - 2 >= rv:
+                word = word[:-1]
+        elif word.endswith("ь") and len(word) - 1 >= rv:
+            word = word[:-1]
+    return word
+
+def stem_english(word):
+    """Strip English plural and common verb/adverb suffixes"""
+    if len(word) <= 3:
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("sses") or word.endswith(("xes", "zes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    for suffix in ("ing", "ed", "ly"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
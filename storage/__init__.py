@@ -0,0 +1 @@
+# Storage backends for TripwireBot
\ No newline at end of file
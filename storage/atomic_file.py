@@ -0,0 +1,28 @@
+import os
+import tempfile
+
+def write_atomic(filename, content, fsync=False, replace=os.replace):
+    """Write a text file through a temporary file moved over it
+
+    content is a string or a function writing to the open file. Readers
+    see either the old or the complete new file, and the temporary file is
+    removed if anything fails. With fsync the data is on disk before the
+    move; replace(tmp_filename, filename) does the move, for callers that
+    hold locks around it.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(prefix=os.path.basename(filename), suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            if callable(content):
+                content(f)
+            else:
+                f.write(content)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
@@ -0,0 +1,96 @@
+class StorageBackend:
+    """Base class for user data storage backends
+
+    Records use the JSON layout of user_data.json and are keyed by the
+    user ID as a string.
+    """
+    
+    # True if get/put/delete do disk I/O and must not run on the event loop
+    blocking_io = False
+    
+    def load(self):
+        """Load the store"""
+        raise NotImplementedError
+    
+    def reload(self):
+        """Re-read the store from disk"""
+        return self.load()
+    
+    def reload_if_changed(self):
+        """Re-read the store if it was modified externally, return True if reloaded"""
+        return False
+    
+    def read_external_changes(self):
+        """Apply changes other processes made since the last call
+
+        Returns a list of (user_id as int, old summary, new summary), where a
+        summary is (consent_given, consent_date) or None for a missing
+        record, or None if the changes cannot be followed incrementally and
+        reload_if_changed has to be used instead.
+        """
+        return None
+    
+    def watched_files(self):
+        """Files whose external modification should trigger reload_if_changed"""
+        return []
+    
+    def get(self, user_id):
+        """Get a record by user ID or None"""
+        raise NotImplementedError
+    
+    def put(self, user_id, record):
+        """Insert or replace a record"""
+        raise NotImplementedError
+    
+    def delete(self, user_id):
+        """Delete a record, return True if it existed"""
+        raise NotImplementedError
+    
+    def delete_many(self, user_ids):
+        """Delete many records in one write, return list of (user_id, record) that existed"""
+        removed = []
+        for user_id in user_ids:
+            record = self.get(user_id)
+            if record is not None and self.delete(user_id):
+                removed.append((user_id, record))
+        return removed
+    
+    def user_ids(self):
+        """Iterate over all user IDs"""
+        raise NotImplementedError
+    
+    def items(self):
+        """Iterate over (user_id, record) pairs"""
+        raise NotImplementedError
+    
+    def consent_summary_chunks(self):
+        """Iterate over (chunk, summaries) covering all records
+
+        summaries iterates over (user_id as int, consent_given, consent_date)
+        of the records of one chunk (see chunk_of). The records of a chunk are
+        fixed at the moment the chunk is yielded, later changes are not
+        reflected in its summaries.
+        """
+        yield None, (
+            (int(user_id), bool(record.get("consent_given", False)), record.get("consent_date"))
+            for user_id, record in self.items()
+        )
+    
+    def chunk_of(self, user_id):
+        """Chunk of consent_summary_chunks that contains user_id"""
+        return None
+    
+    def count(self):
+        """Number of records"""
+        raise NotImplementedError
+    
+    def flush(self):
+        """Persist everything that is still kept in memory only"""
+    
+    def erase_deleted(self):
+        """Remove what is left of deleted records from the files on disk"""
+        self.flush()
+    
+    def close(self):
+        """Flush and release files and connections"""
+        self.flush()
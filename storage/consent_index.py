@@ -0,0 +1,83 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain, filterfalse, islice
+
+class ConsentIndex:
+    """Compact in-memory set of IDs of users who gave consent
+
+    IDs are kept as a sorted array of int64 (8 bytes per user) searched with
+    bisect. Recent additions and removals go to two small sets and are
+    merged into the array once they grow past a fraction of its size, which
+    keeps updates cheap and the amortized merge cost constant per change.
+    """
+    
+    def __init__(self, user_ids=(), merge_fraction=16, min_merge=4096):
+        self.merge_fraction = merge_fraction
+        self.min_merge = min_merge
+        ids = array('q', user_ids)
+        if any(ids[i] >= ids[i + 1] for i in range(len(ids) - 1)):
+            ids = array('q', sorted(set(ids)))
+        self._ids = ids
+        self._added = set()
+        self._removed = set()
+    
+    def __contains__(self, user_id):
+        if user_id in self._added:
+            return True
+        if user_id in self._removed:
+            return False
+        return self._in_array(user_id)
+    
+    def __len__(self):
+        return len(self._ids) + len(self._added) - len(self._removed)
+    
+    def __iter__(self):
+        """Iterate over user IDs in ascending order"""
+        self._merge()
+        return iter(self._ids)
+    
+    def iter_after(self, user_id):
+        """Iterate over user IDs greater than user_id in ascending order
+
+        Iterates over the array as it is now, later changes are not seen.
+        """
+        self._merge()
+        ids = self._ids
+        return islice(ids, bisect_right(ids, user_id), None)
+    
+    def add(self, user_id):
+        self._removed.discard(user_id)
+        if not self._in_array(user_id):
+            self._added.add(user_id)
+            self._merge_if_needed()
+    
+    def discard(self, user_id):
+        self._added.discard(user_id)
+        if self._in_array(user_id):
+            self._removed.add(user_id)
+            self._merge_if_needed()
+    
+    def memory_usage(self):
+        """Approximate memory used by the index in bytes"""
+        import sys
+        return (self._ids.buffer_info()[1] * self._ids.itemsize
+                + sys.getsizeof(self._added) + sys.getsizeof(self._removed))
+    
+    def _in_array(self, user_id):
+        ids = self._ids
+        i = bisect_left(ids, user_id)
+        return i < len(ids) and ids[i] == user_id
+    
+    def _merge_if_needed(self):
+        pending = len(self._added) + len(self._removed)
+        if pending >= max(self.min_merge, len(self._ids) // self.merge_fraction):
+            self._merge()
+    
+    def _merge(self):
+        if not self._added and not self._removed:
+            return
+        # Both inputs are sorted runs, so timsort merges them in linear time
+        kept = filterfalse(self._removed.__contains__, self._ids)
+        self._ids = array('q', sorted(chain(kept, self._added)))
+        self._added = set()
+        self._removed = set()
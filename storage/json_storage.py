@@ -0,0 +1,707 @@
+import contextlib
+import json
+import os
+import logging
+import threading
+import time
+from storage.atomic_file import write_atomic
+from storage.base import StorageBackend
+from storage.file_lock import FileLock, try_lock_file
+from storage.user_record import UserRecord
+
+logger = logging.getLogger(__name__)
+
+def _file_signature(path):
+    """(inode, mtime, size) of a file or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def _journal_generation(f):
+    """Generation number from the header line of an open journal, None if it has none
+
+    Every rotation starts a journal numbered one higher than the one moved
+    aside, so a follower can tell whether it skipped a whole journal.
+    """
+    head = os.pread(f.fileno(), 64, 0)
+    line = head.split(b"\n", 1)[0]
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+    if isinstance(entry, dict) and entry.get("op") == "generation":
+        return entry.get("generation")
+    return None
+
+def _open_existing(path, mode):
+    try:
+        if "b" in mode:
+            return open(path, mode)
+        return open(path, mode, encoding='utf-8')
+    except FileNotFoundError:
+        return None
+
+class JsonStorage(StorageBackend):
+    """User data kept in memory and stored in a JSON file
+
+    In "json" mode changes are coalesced: a background flusher rewrites the
+    whole file once per flush_window seconds (or as soon as flush_max_dirty
+    records changed). In "journal" mode every change is appended to a
+    journal file instead; the journal is periodically compacted into the
+    JSON snapshot in a background thread, and loading replays the snapshot
+    followed by the journal. The snapshot is always written to a temporary
+    file and moved over the old one, so a crash never leaves it half-written.
+
+    In memory records are kept as UserRecord objects keyed by the user ID as
+    an int; they are converted to the JSON layout when they are written or
+    handed out.
+
+    Several processes can share the files. Writes are serialized with a
+    lock file; in "journal" mode each process follows the journal and picks
+    up the entries of the others (read_external_changes), and in "json"
+    mode the flusher writes only its own changed records over the current
+    file contents.
+    """
+    
+    def __init__(self, filename, mode="journal", journal_filename=None, compact_threshold=1000,
+                 flush_window=0.5, flush_max_dirty=100):
+        self.filename = filename
+        self.mode = mode
+        self.journal_filename = journal_filename or f"{filename}.journal"
+        self.compacting_filename = f"{self.journal_filename}.compacting"
+        self.compact_threshold = compact_threshold
+        self.flush_window = flush_window
+        self.flush_max_dirty = flush_max_dirty
+        self.data = {}
+        # Signature of the snapshot the data is based on
+        self.snapshot_state = None
+        # Bytes of the followed journal that are reflected in data
+        self.last_journal_size = 0
+        self.journal_entries = 0
+        self._version = 0
+        self._journal_file = None
+        # Read handle of the journal being followed; stays valid after rotation
+        self._tail_file = None
+        self._journal_rotated = False
+        # Generation the next followed journal must have after a rotation, None if unchecked
+        self._expected_generation = None
+        # A journal generation was skipped while following, only a reload catches up
+        self._stale = False
+        self._compaction_thread = None
+        self._lock = threading.RLock()
+        # Records changed in memory but not written to the file yet ("json" mode)
+        self._dirty = set()
+        self._flush_condition = threading.Condition(self._lock)
+        self._flusher_thread = None
+        self._closing = False
+        # Serializes writers of this and other processes
+        self._write_lock = FileLock(f"{filename}.lock")
+    
+    @property
+    def journaled(self):
+        return self.mode == "journal"
+    
+    @property
+    def blocking_io(self):
+        # Journal mode appends every change under the cross-process lock file,
+        # "json" mode only marks it for the background flusher
+        return self.journaled
+    
+    def exists(self):
+        """Check if there is anything stored on disk"""
+        return os.path.exists(self.filename) or (self.journaled and self._journal_exists())
+    
+    def load(self):
+        data, entries, state = self._read_files(*self._open_files())
+        with self._lock:
+            self._set_data(data, entries, state)
+            return len(self.data)
+    
+    def reload_if_changed(self, attempts=3):
+        """Re-read changed files without holding the lock while parsing
+
+        The new data is built aside and swapped in only if nothing was written
+        in the meantime, so readers see either the old or the new data set.
+        """
+        for _ in range(attempts):
+            with self._lock:
+                if not (self.exists() and self._files_changed()):
+                    return False
+                version = self._version
+            data, journal_entries, state = self._read_files(*self._open_files())
+            with self._lock:
+                if self._version == version:
+                    # Changes that are not flushed yet win over the file contents
+                    for user_id in self._dirty:
+                        if user_id in self.data:
+                            data[user_id] = self.data[user_id]
+                        else:
+                            data.pop(user_id, None)
+                    self._set_data(data, journal_entries, state)
+                    return True
+            if state[1] is not None:
+                state[1].close()
+        return False
+    
+    def read_external_changes(self):
+        """Apply journal entries appended by other processes
+
+        Returns (user_id, old summary, new summary) for every applied entry,
+        or None when the snapshot was replaced by something other than a
+        compaction and reload_if_changed is needed.
+        """
+        if not self.journaled:
+            return None
+        with self._lock:
+            changes = []
+            self._follow_journal(changes)
+            if changes:
+                self._version += 1
+            if self._stale:
+                return None
+            state = _file_signature(self.filename)
+            if state != self.snapshot_state:
+                # A compaction folds entries that were already applied into the
+                # snapshot, any other replacement needs a full reload
+                if not self._journal_rotated or os.path.exists(self.compacting_filename):
+                    return None
+                self.snapshot_state = state
+                self._journal_rotated = False
+            return changes
+    
+    def watched_files(self):
+        if self.journaled:
+            return [self.filename, self.journal_filename]
+        return [self.filename]
+    
+    def get(self, user_id):
+        record = self.data.get(int(user_id))
+        return record.to_dict() if record is not None else None
+    
+    def put(self, user_id, record):
+        user_record = UserRecord.from_dict(user_id, record)
+        with self._journal_lock(), self._lock:
+            self.data[user_record.user_id] = user_record
+            self._version += 1
+            if self.journaled:
+                self._append_journal({"op": "set", "user_id": str(user_id), "record": record})
+            else:
+                self._mark_dirty(user_record.user_id)
+    
+    def delete(self, user_id):
+        key = int(user_id)
+        with self._journal_lock(), self._lock:
+            if key not in self.data:
+                return False
+            del self.data[key]
+            self._version += 1
+            if self.journaled:
+                self._append_journal({"op": "delete", "user_id": str(key)})
+            else:
+                self._mark_dirty(key)
+            return True
+    
+    def delete_many(self, user_ids):
+        with self._journal_lock(), self._lock:
+            removed = []
+            for user_id in user_ids:
+                record = self.data.pop(int(user_id), None)
+                if record is not None:
+                    removed.append(record)
+            if removed:
+                self._version += 1
+                if self.journaled:
+                    self._append_journal(*({"op": "delete", "user_id": str(record.user_id)} for record in removed))
+                else:
+                    self._mark_dirty(*(record.user_id for record in removed))
+            return [(str(record.user_id), record.to_dict()) for record in removed]
+    
+    def user_ids(self):
+        keys = list(self.data.keys())
+        return (str(user_id) for user_id in keys)
+    
+    def items(self):
+        records = list(self.data.values())
+        return ((str(record.user_id), record.to_dict()) for record in records)
+    
+    def consent_summary_chunks(self):
+        # Summaries come straight from the records, without building dicts
+        records = list(self.data.values())
+        yield None, ((record.user_id, record.has_consent(), record.consent_day()) for record in records)
+    
+    def count(self):
+        return len(self.data)
+    
+    def flush(self):
+        if not self.journaled:
+            self._write_dirty()
+    
+    def save(self):
+        """Write the whole data set to the JSON file"""
+        if self.journaled:
+            self._wait_for_compaction()
+            # Fold the journal into the snapshot right away
+            self._compact()
+        else:
+            self._write_dirty(force=True)
+    
+    def erase_deleted(self):
+        # Deleted records stay in the snapshot and in journal entries written
+        # before the delete until the journal is folded into a new snapshot
+        self.save()
+    
+    def close(self):
+        """Write pending changes, wait for a running compaction and close the files"""
+        with self._lock:
+            self._closing = True
+            self._flush_condition.notify_all()
+        if self._flusher_thread is not None:
+            self._flusher_thread.join()
+            self._flusher_thread = None
+        self._write_dirty()
+        self._wait_for_compaction()
+        with self._lock:
+            self._closing = False
+            for handle in (self._journal_file, self._tail_file):
+                if handle is not None:
+                    handle.close()
+            self._journal_file = None
+            self._tail_file = None
+        self._write_lock.close()
+    
+    def _journal_lock(self):
+        """Lock held while changing records: in "journal" mode changes go to the shared journal right away"""
+        return self._write_lock if self.journaled else contextlib.nullcontext()
+    
+    # -------------------------------------------------------------------------
+    # Write coalescing ("json" mode)
+    # -------------------------------------------------------------------------
+    
+    def _mark_dirty(self, *user_ids):
+        """Schedule changed records for the next coalesced write"""
+        was_clean = not self._dirty
+        self._dirty.update(user_ids)
+        if self._flusher_thread is None and not self._closing:
+            self._flusher_thread = threading.Thread(target=self._run_flusher, name="json-flusher", daemon=True)
+            self._flusher_thread.start()
+        elif was_clean or len(self._dirty) >= self.flush_max_dirty:
+            # Wake the flusher to start a new window or to write a full batch now
+            self._flush_condition.notify_all()
+    
+    def _run_flusher(self):
+        """Write the file once per burst of changes"""
+        while True:
+            with self._lock:
+                while not self._dirty and not self._closing:
+                    self._flush_condition.wait()
+                if self._closing:
+                    return
+                deadline = time.monotonic() + self.flush_window
+                while len(self._dirty) < self.flush_max_dirty and not self._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._flush_condition.wait(remaining)
+            self._write_dirty()
+    
+    def _write_dirty(self, force=False):
+        """Write the data set if there are pending changes (or always if force)"""
+        # Writers are serialized so an older snapshot never replaces a newer one
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty and not force:
+                    return
+                pending = self._dirty
+                self._dirty = set()
+                # Someone else wrote the file since we read it
+                external = _file_signature(self.filename) != self.snapshot_state
+                if external:
+                    changes = {user_id: self.data.get(user_id) for user_id in pending}
+                else:
+                    snapshot = dict(self.data)
+            started = time.monotonic()
+            try:
+                if external:
+                    # Only our changed records go over the current file contents,
+                    # so the changes of other processes are kept
+                    snapshot = self._read_files(_open_existing(self.filename, 'r'), None, None)[0]
+                    for user_id, record in changes.items():
+                        if record is None:
+                            snapshot.pop(user_id, None)
+                        else:
+                            snapshot[user_id] = record
+                # The file then holds changes we have not loaded yet, so it is left
+                # to look modified and the next reload picks them up
+                self._write_snapshot(snapshot, remember=not external)
+            except Exception as e:
+                logger.error(f"Error writing {self.filename}: {e}")
+                with self._lock:
+                    self._dirty |= pending
+                return
+            logger.info(f"Data saved to {self.filename} ({len(pending)} changed records, "
+                        f"{time.monotonic() - started:.2f}s)")
+    
+    def _write_snapshot(self, snapshot, after_replace=None, remember=True):
+        """Write snapshot to a temporary file and atomically move it over the JSON file"""
+        def replace(tmp_filename, filename):
+            with self._write_lock, self._lock:
+                os.replace(tmp_filename, filename)
+                if after_replace is not None:
+                    after_replace()
+                if remember:
+                    # Our own write is not an external modification
+                    self.snapshot_state = _file_signature(filename)
+                    self._journal_rotated = False
+                self._version += 1
+        
+        write_atomic(self.filename, lambda f: self._dump_records(snapshot, f), fsync=True, replace=replace)
+    
+    @staticmethod
+    def _dump_records(snapshot, f):
+        """Write records in the JSON layout one at a time
+
+        The output is the same as json.dump(..., indent=2) of the whole data
+        set, but only one record is converted to a dict at a time.
+        """
+        separator = "\n  "
+        f.write("{")
+        for user_id, record in snapshot.items():
+            value = json.dumps(record.to_dict(), ensure_ascii=False, indent=2).replace("\n", "\n  ")
+            f.write(f'{separator}"{user_id}": {value}')
+            separator = ",\n  "
+        f.write("\n}" if snapshot else "}")
+    
+    # -------------------------------------------------------------------------
+    # Reading files
+    # -------------------------------------------------------------------------
+    
+    def _journal_exists(self):
+        return os.path.exists(self.journal_filename) or os.path.exists(self.compacting_filename)
+    
+    def _open_files(self):
+        """Open the snapshot, the journal being compacted and the journal at one moment
+
+        Rotating and compacting the journal happen under the write lock, so
+        the files opened under it belong together. They are read afterwards
+        through the open handles, which stay valid when other processes
+        replace or remove the files meanwhile.
+        """
+        with self._write_lock:
+            snapshot = _open_existing(self.filename, 'r')
+            compacting = journal = None
+            if self.journaled:
+                compacting = _open_existing(self.compacting_filename, 'rb')
+                journal = _open_existing(self.journal_filename, 'rb')
+        return snapshot, compacting, journal
+    
+    def _read_files(self, snapshot, compacting, journal):
+        """Read the snapshot and replay journal entries on top of it
+
+        Returns (data, journal entries, (snapshot signature, journal handle,
+        bytes of the journal read)). The journal handle is left open so the
+        journal can be followed from there.
+        """
+        data = {}
+        entries = 0
+        snapshot_state = None
+        journal_size = 0
+        try:
+            if snapshot is not None:
+                stat = os.fstat(snapshot.fileno())
+                snapshot_state = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                data = {int(user_id): UserRecord.from_dict(user_id, record)
+                        for user_id, record in json.load(snapshot).items()}
+            # Entries being compacted precede the live journal. Replaying them over a
+            # snapshot that already contains them is harmless.
+            if compacting is not None:
+                entries += self._replay_journal(compacting, data)[0]
+            if journal is not None:
+                journal_entries, journal_size = self._replay_journal(journal, data)
+                entries += journal_entries
+        except BaseException:
+            if journal is not None:
+                journal.close()
+            raise
+        finally:
+            for f in (snapshot, compacting):
+                if f is not None:
+                    f.close()
+        return data, entries, (snapshot_state, journal, journal_size)
+    
+    def _set_data(self, data, entries, state):
+        """Swap in freshly read data (called with _lock held)"""
+        self.data = data
+        self.journal_entries = entries
+        self.snapshot_state, tail_file, self.last_journal_size = state
+        if self._tail_file is not None:
+            self._tail_file.close()
+        self._tail_file = tail_file
+        self._journal_rotated = False
+        self._expected_generation = None
+        self._stale = False
+        self._version += 1
+    
+    def _files_changed(self):
+        """Check whether files were changed by someone else since our last read/write"""
+        if self._stale or _file_signature(self.filename) != self.snapshot_state:
+            return True
+        if not self.journaled:
+            return False
+        journal = _file_signature(self.journal_filename)
+        if self._tail_file is None:
+            return journal is not None
+        return (journal is None or journal[0] != os.fstat(self._tail_file.fileno()).st_ino
+                or journal[2] != self.last_journal_size)
+    
+    # -------------------------------------------------------------------------
+    # Journal internals
+    # -------------------------------------------------------------------------
+    
+    def _replay_journal(self, f, data, changes=None):
+        """Apply entries from the current position of f to data, return (entries, bytes read)
+
+        With a changes list, (user_id, old summary, new summary) of every
+        entry is appended to it.
+        """
+        start = f.tell()
+        chunk = f.read()
+        end = chunk.rfind(b"\n") + 1
+        # An unterminated last line is being written right now or was torn by
+        # a crash; it is left for the next read
+        f.seek(start + end)
+        entries = 0
+        for line in chunk[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+                if entry.get("op") == "generation":
+                    continue
+                user_id = int(entry["user_id"])
+            except (ValueError, KeyError, AttributeError):
+                logger.warning(f"Skipping corrupted journal entry in {f.name}")
+                continue
+            old_record = data.get(user_id)
+            if entry.get("op") == "set":
+                new_record = data[user_id] = UserRecord.from_dict(user_id, entry["record"])
+            elif entry.get("op") == "delete":
+                data.pop(user_id, None)
+                new_record = None
+            else:
+                continue
+            if changes is not None:
+                changes.append((
+                    user_id,
+                    old_record.summary() if old_record is not None else None,
+                    new_record.summary() if new_record is not None else None
+                ))
+            entries += 1
+        return entries, end
+    
+    def _follow_journal(self, changes):
+        """Apply entries appended to the journal since we last looked (called with _lock held)
+
+        When the journal was rotated more than once since the last look, the
+        entries of the journals in between are only in the snapshot, so the
+        data is marked stale and has to be reloaded.
+        """
+        while not self._stale:
+            self._read_tail(changes)
+            journal = _file_signature(self.journal_filename)
+            if journal is None:
+                return
+            if self._tail_file is not None:
+                if os.fstat(self._tail_file.fileno()).st_ino == journal[0]:
+                    return
+                # The journal was rotated. Nothing is appended to the old one any
+                # more, so whatever is left in it is read before switching over.
+                self._read_tail(changes)
+                generation = _journal_generation(self._tail_file)
+                # A journal without a header (older version) cannot be checked
+                self._expected_generation = generation + 1 if generation is not None else -1
+                self._tail_file.close()
+                self._tail_file = None
+                self._journal_rotated = True
+            if not self._open_tail():
+                # Between the rotation and the creation of its successor
+                return
+    
+    def _open_tail(self):
+        """Start following the live journal after its header, return False if there is none
+
+        After a rotation the journal must be the direct successor of the
+        one followed before, otherwise the data is marked stale.
+        """
+        f = _open_existing(self.journal_filename, 'rb')
+        if f is None:
+            return False
+        header = f.readline()
+        generation = _journal_generation(f)
+        if generation is None:
+            header = b""
+        f.seek(len(header))
+        self._tail_file = f
+        self.last_journal_size = len(header)
+        self.journal_entries = 0
+        if self._expected_generation is not None:
+            if generation != self._expected_generation:
+                self._stale = True
+            self._expected_generation = None
+        return True
+    
+    def _read_tail(self, changes):
+        if self._tail_file is None:
+            return
+        entries, size = self._replay_journal(self._tail_file, self.data, changes)
+        self.last_journal_size += size
+        self.journal_entries += entries
+    
+    def _open_journal(self):
+        """Get the append handle of the live journal (called with the write lock held)"""
+        if self._journal_file is not None:
+            journal = _file_signature(self.journal_filename)
+            if journal is None or journal[0] != os.fstat(self._journal_file.fileno()).st_ino:
+                # Rotated by a compaction (possibly in another process)
+                self._journal_file.close()
+                self._journal_file = None
+        if self._journal_file is None:
+            self._journal_file = open(self.journal_filename, 'ab')
+            size = os.fstat(self._journal_file.fileno()).st_size
+            if not size:
+                # First journal of this store (or its predecessor is gone)
+                self._write_generation(self._journal_file, 0)
+            else:
+                with open(self.journal_filename, 'rb') as f:
+                    f.seek(size - 1)
+                    if f.read(1) != b"\n":
+                        # Terminate a line torn by a crash, so it does not swallow our entry
+                        self._journal_file.write(b"\n")
+        return self._journal_file
+    
+    @staticmethod
+    def _write_generation(journal_file, generation):
+        journal_file.write(json.dumps({"op": "generation", "generation": generation}).encode('utf-8') + b"\n")
+        journal_file.flush()
+    
+    def _append_journal(self, *entries):
+        """Append changes to the journal in one write, compacting it when it grows too long
+
+        Called with the write lock and _lock held.
+        """
+        journal_file = self._open_journal()
+        position = os.fstat(journal_file.fileno()).st_size
+        lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries).encode('utf-8')
+        journal_file.write(lines)
+        journal_file.flush()
+        if self._tail_file is None:
+            self._open_tail()
+        if (self._tail_file is not None and self.last_journal_size == position
+                and os.fstat(self._tail_file.fileno()).st_ino == os.fstat(journal_file.fileno()).st_ino):
+            # Nobody else wrote in between, our own entries need no replay
+            self.last_journal_size = position + len(lines)
+            self._tail_file.seek(self.last_journal_size)
+        self.journal_entries += len(entries)
+        
+        if self.journal_entries >= self.compact_threshold and self._compaction_thread is None:
+            self._compaction_thread = threading.Thread(target=self._compact, name="journal-compaction", daemon=True)
+            self._compaction_thread.start()
+    
+    def _caught_up(self):
+        """Check whether data reflects exactly the snapshot and the journal on disk"""
+        if _file_signature(self.filename) != self.snapshot_state or os.path.exists(self.compacting_filename):
+            return False
+        journal = _file_signature(self.journal_filename)
+        if self._tail_file is None:
+            return journal is None
+        tail = os.fstat(self._tail_file.fileno())
+        if journal is None:
+            return tail.st_size == self.last_journal_size
+        return tail.st_ino == journal[0] and journal[2] == self.last_journal_size
+    
+    def _rotate_journal(self):
+        """Move the live journal aside so new changes go to a fresh one
+
+        Returns the journal to compact, opened and locked so no other process
+        compacts it at the same time, or None if there is nothing to compact
+        or another process is compacting already. Called with the write lock
+        and _lock held.
+        """
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+        generation = None
+        if os.path.exists(self.compacting_filename):
+            compacting = open(self.compacting_filename, 'ab')
+            if not try_lock_file(compacting):
+                compacting.close()
+                return None
+            if os.path.exists(self.journal_filename):
+                # Leftover of an interrupted compaction - keep its entries in order
+                with open(self.journal_filename, 'rb') as src:
+                    generation = _journal_generation(src)
+                    compacting.write(src.read())
+                compacting.flush()
+                os.remove(self.journal_filename)
+        elif os.path.exists(self.journal_filename):
+            with open(self.journal_filename, 'rb') as src:
+                generation = _journal_generation(src)
+            os.replace(self.journal_filename, self.compacting_filename)
+            compacting = open(self.compacting_filename, 'ab')
+            try_lock_file(compacting)
+        else:
+            return None
+        if generation is not None:
+            # The successor exists right away, so followers can check they missed nothing
+            with open(self.journal_filename, 'xb') as journal_file:
+                self._write_generation(journal_file, generation + 1)
+        self._version += 1
+        self.journal_entries = 0
+        return compacting
+    
+    def _remove_compacted_journal(self):
+        if os.path.exists(self.compacting_filename):
+            os.remove(self.compacting_filename)
+    
+    def _wait_for_compaction(self):
+        thread = self._compaction_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+    
+    def _compact(self):
+        """Fold the journal into the snapshot and drop the journal entries it contains"""
+        started = time.monotonic()
+        compacting = None
+        try:
+            with self._write_lock, self._lock:
+                # Records in memory can be written as they are only if they
+                # reflect the files exactly; otherwise (other processes wrote
+                # entries not followed yet) the snapshot is built from the files
+                caught_up = self._caught_up()
+                compacting = self._rotate_journal()
+                if compacting is None:
+                    return
+                if caught_up:
+                    snapshot = dict(self.data)
+                    # Everything rotated out is already applied
+                    if self._tail_file is not None:
+                        self._tail_file.close()
+                        self._tail_file = None
+                    self.last_journal_size = 0
+                    self._open_tail()
+                else:
+                    files = (_open_existing(self.filename, 'r'), _open_existing(self.compacting_filename, 'rb'), None)
+            if not caught_up:
+                snapshot = self._read_files(*files)[0]
+            self._write_snapshot(snapshot, after_replace=self._remove_compacted_journal, remember=caught_up)
+            logger.info(f"Compacted journal into {self.filename} ({len(snapshot)} records, "
+                        f"{time.monotonic() - started:.2f}s)")
+        except Exception as e:
+            logger.error(f"Error compacting journal: {e}")
+        finally:
+            if compacting is not None:
+                compacting.close()
+            if threading.current_thread() is self._compaction_thread:
+                self._compaction_thread = None
@@ -0,0 +1,225 @@
+import os
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+from storage.base import StorageBackend
+from storage.json_storage import JsonStorage
+
+logger = logging.getLogger(__name__)
+
+class ShardedStorage(StorageBackend):
+    """User data split across JSON shard files by a hash of the user ID
+
+    Every shard is a JsonStorage of its own, loaded on first access. Loaded
+    shards are kept in LRU order and the least recently used ones are
+    flushed and dropped once more than max_records_in_memory records are
+    loaded. A write only touches the shard of its user, and iterating over
+    the store walks the shards one by one, so memory stays bounded by the
+    budget no matter how big the store is.
+
+    Building the consent index and statistics still parses every shard
+    once at startup, one at a time and without keeping them loaded.
+    """
+    
+    # Loading a shard parses its file
+    blocking_io = True
+    
+    def __init__(self, directory, shards=64, shard_mode="journal", max_records_in_memory=1000000,
+                 compact_threshold=1000, flush_window=0.5, flush_max_dirty=100):
+        self.filename = directory
+        self.shard_count = shards
+        self.shard_mode = shard_mode
+        self.max_records_in_memory = max_records_in_memory
+        self.compact_threshold = compact_threshold
+        self.flush_window = flush_window
+        self.flush_max_dirty = flush_max_dirty
+        self._shards = OrderedDict()
+        # File state of evicted shards, to notice external edits while they are not loaded
+        self._evicted_state = {}
+        self._lock = threading.RLock()
+    
+    def shard_of(self, user_id):
+        """Shard number of a user ID"""
+        return zlib.crc32(str(user_id).encode()) % self.shard_count
+    
+    def shard_filename(self, shard_number):
+        return os.path.join(self.filename, f"shard_{shard_number:03d}.json")
+    
+    def load(self):
+        os.makedirs(self.filename, exist_ok=True)
+        with self._lock:
+            shards = list(self._shards.values())
+            self._shards.clear()
+            self._evicted_state.clear()
+        for shard in shards:
+            shard.close()
+    
+    def reload_if_changed(self):
+        with self._lock:
+            loaded = list(self._shards.values())
+            evicted = list(self._evicted_state.items())
+        changed = False
+        # Loaded shards re-read themselves outside of our lock, so lookups
+        # in other shards are not held up meanwhile
+        for shard in loaded:
+            if shard.reload_if_changed():
+                changed = True
+        for shard_number, state in evicted:
+            current = self._file_state(shard_number)
+            if current != state:
+                with self._lock:
+                    if shard_number in self._evicted_state:
+                        self._evicted_state[shard_number] = current
+                changed = True
+        return changed
+    
+    def read_external_changes(self):
+        with self._lock:
+            loaded = list(self._shards.values())
+            evicted = list(self._evicted_state.items())
+        # Records of evicted shards are not in memory, so changes there can
+        # only be picked up by a full reload
+        for shard_number, state in evicted:
+            if self._file_state(shard_number) != state:
+                return None
+        changes = []
+        for shard in loaded:
+            shard_changes = shard.read_external_changes()
+            if shard_changes is None:
+                return None
+            changes.extend(shard_changes)
+        return changes
+    
+    def watched_files(self):
+        return [self.filename]
+    
+    def get(self, user_id):
+        with self._lock:
+            return self._shard(self.shard_of(user_id)).get(user_id)
+    
+    def put(self, user_id, record):
+        # Held across the write so the shard cannot be evicted halfway through
+        with self._lock:
+            self._shard(self.shard_of(user_id)).put(user_id, record)
+            self._evict()
+    
+    def delete(self, user_id):
+        with self._lock:
+            return self._shard(self.shard_of(user_id)).delete(user_id)
+    
+    def delete_many(self, user_ids):
+        by_shard = {}
+        for user_id in user_ids:
+            by_shard.setdefault(self.shard_of(user_id), []).append(user_id)
+        removed = []
+        with self._lock:
+            # One write per affected shard
+            for shard_number, shard_user_ids in by_shard.items():
+                removed.extend(self._shard(shard_number).delete_many(shard_user_ids))
+        return removed
+    
+    def user_ids(self):
+        for shard_number in range(self.shard_count):
+            yield from self._shard(shard_number).user_ids()
+    
+    def items(self):
+        for shard_number in range(self.shard_count):
+            yield from self._shard(shard_number).items()
+    
+    def consent_summary_chunks(self):
+        for shard_number in range(self.shard_count):
+            with self._lock:
+                shard = self._shards.get(shard_number)
+                if shard is not None:
+                    chunks = list(shard.consent_summary_chunks())
+                else:
+                    # Read once and dropped, so a full scan does not evict the shards in use
+                    state = self._file_state(shard_number)
+                    shard = self._open_shard(shard_number)
+                    chunks = list(shard.consent_summary_chunks())
+                    shard.close()
+                    self._evicted_state[shard_number] = state
+            for _, summaries in chunks:
+                yield shard_number, summaries
+    
+    def chunk_of(self, user_id):
+        return self.shard_of(user_id)
+    
+    def count(self):
+        return sum(self._shard(shard_number).count() for shard_number in range(self.shard_count))
+    
+    def flush(self):
+        with self._lock:
+            shards = list(self._shards.values())
+        for shard in shards:
+            shard.flush()
+    
+    def erase_deleted(self):
+        # Evicted shards are closed without compaction, so every shard with
+        # a journal may still hold deleted records
+        for shard_number in range(self.shard_count):
+            filename = self.shard_filename(shard_number)
+            if os.path.exists(f"{filename}.journal") or os.path.exists(f"{filename}.journal.compacting"):
+                with self._lock:
+                    self._shard(shard_number).erase_deleted()
+    
+    def close(self):
+        with self._lock:
+            shards = list(self._shards.values())
+            self._shards.clear()
+        for shard in shards:
+            shard.close()
+    
+    def loaded_shards(self):
+        """Numbers of the shards currently held in memory"""
+        with self._lock:
+            return list(self._shards.keys())
+    
+    def _shard(self, shard_number):
+        """Get a shard, loading it on first access"""
+        with self._lock:
+            shard = self._shards.get(shard_number)
+            if shard is not None:
+                self._shards.move_to_end(shard_number)
+                return shard
+            shard = self._open_shard(shard_number)
+            self._shards[shard_number] = shard
+            self._evicted_state.pop(shard_number, None)
+            self._evict()
+            return shard
+    
+    def _open_shard(self, shard_number):
+        filename = self.shard_filename(shard_number)
+        shard = JsonStorage(
+            filename,
+            mode=self.shard_mode,
+            journal_filename=f"{filename}.journal",
+            compact_threshold=self.compact_threshold,
+            flush_window=self.flush_window,
+            flush_max_dirty=self.flush_max_dirty
+        )
+        shard.load()
+        return shard
+    
+    def _evict(self):
+        """Drop least recently used shards while over the memory budget"""
+        with self._lock:
+            loaded = sum(shard.count() for shard in self._shards.values())
+            while loaded > self.max_records_in_memory and len(self._shards) > 1:
+                shard_number, shard = self._shards.popitem(last=False)
+                loaded -= shard.count()
+                shard.close()
+                self._evicted_state[shard_number] = self._file_state(shard_number)
+                logger.debug(f"Evicted shard {shard_number} ({shard.count()} records)")
+    
+    def _file_state(self, shard_number):
+        filename = self.shard_filename(shard_number)
+        state = []
+        for path in (filename, f"{filename}.journal", f"{filename}.journal.compacting"):
+            try:
+                stat = os.stat(path)
+                state.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                state.append(None)
+        return tuple(state)
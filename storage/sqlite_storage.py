@@ -0,0 +1,321 @@
+import json
+import logging
+import sqlite3
+import threading
+from collections import deque
+from storage.base import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+# Statements are kept as constants so sqlite3 reuses the compiled versions
+# from its statement cache instead of preparing them again on every call.
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    consent_given INTEGER NOT NULL DEFAULT 0,
+    consent_date TEXT,
+    last_updated TEXT,
+    record TEXT NOT NULL DEFAULT '{}'
+)
+"""
+# Every change of a users row is logged by triggers, so processes sharing
+# the database can follow each other's changes (see read_external_changes).
+# The log is trimmed to the last CHANGES_KEPT entries.
+CHANGES_KEPT = 100000
+CREATE_CHANGES = """
+CREATE TABLE IF NOT EXISTS user_changes (
+    seq INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    old_exists INTEGER NOT NULL,
+    old_consent_given INTEGER,
+    old_consent_date TEXT,
+    new_exists INTEGER NOT NULL,
+    new_consent_given INTEGER,
+    new_consent_date TEXT
+)
+"""
+CREATE_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS users_inserted AFTER INSERT ON users BEGIN
+        INSERT INTO user_changes (user_id, old_exists, new_exists, new_consent_given, new_consent_date)
+        VALUES (new.user_id, 0, 1, new.consent_given, new.consent_date);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_updated AFTER UPDATE ON users BEGIN
+        INSERT INTO user_changes (user_id, old_exists, old_consent_given, old_consent_date,
+                                  new_exists, new_consent_given, new_consent_date)
+        VALUES (new.user_id, 1, old.consent_given, old.consent_date, 1, new.consent_given, new.consent_date);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_deleted AFTER DELETE ON users BEGIN
+        INSERT INTO user_changes (user_id, old_exists, old_consent_given, old_consent_date, new_exists)
+        VALUES (old.user_id, 1, old.consent_given, old.consent_date, 0);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS user_changes_trimmed AFTER INSERT ON user_changes
+    WHEN new.seq % 1000 = 0 BEGIN
+        DELETE FROM user_changes WHERE seq <= new.seq - {CHANGES_KEPT};
+    END
+    """
+)
+SELECT_USER = "SELECT consent_given, consent_date, last_updated, record FROM users WHERE user_id = ?"
+UPSERT_USER = """
+INSERT INTO users (user_id, consent_given, consent_date, last_updated, record) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    consent_given = excluded.consent_given,
+    consent_date = excluded.consent_date,
+    last_updated = excluded.last_updated,
+    record = excluded.record
+"""
+DELETE_USER = "DELETE FROM users WHERE user_id = ?"
+SELECT_IDS = "SELECT user_id FROM users ORDER BY user_id"
+SELECT_ALL = "SELECT user_id, consent_given, consent_date, last_updated, record FROM users ORDER BY user_id"
+SELECT_SUMMARIES = "SELECT user_id, consent_given, consent_date FROM users ORDER BY user_id"
+COUNT_USERS = "SELECT COUNT(*) FROM users"
+LAST_CHANGE = "SELECT COALESCE(MAX(seq), 0) FROM user_changes"
+FIRST_CHANGE = "SELECT MIN(seq) FROM user_changes"
+SELECT_CHANGES = """
+SELECT seq, user_id, old_exists, old_consent_given, old_consent_date, new_exists, new_consent_given, new_consent_date
+FROM user_changes WHERE seq > ? ORDER BY seq
+"""
+
+INDEXED_FIELDS = ("consent_given", "consent_date", "last_updated")
+# Host parameters per statement supported by every SQLite version
+SQL_VARIABLES_LIMIT = 999
+
+class SQLiteStorage(StorageBackend):
+    """User data stored in an SQLite database
+
+    Records are looked up through the user_id primary key, so reads, saves
+    and deletes cost O(log N) regardless of the store size and nothing is
+    kept in memory. The database runs in WAL mode so readers never block
+    the writer, and several processes can share it: writers wait up to
+    busy_timeout seconds for each other.
+    """
+    
+    blocking_io = True
+    
+    def __init__(self, filename, batch_size=1000, busy_timeout=30.0):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.busy_timeout = busy_timeout
+        self._connection = None
+        self._lock = threading.Lock()
+        # Position in user_changes up to which changes are reflected by the caller
+        self._seen_change = 0
+        # Ranges of user_changes written by us and not reached by _seen_change yet
+        self._own_changes = deque()
+        self._data_version = None
+        self._stale = False
+    
+    def load(self):
+        with self._lock:
+            if self._connection is None:
+                self._connection = sqlite3.connect(self.filename, timeout=self.busy_timeout, check_same_thread=False)
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute("PRAGMA synchronous=NORMAL")
+                with self._connection:
+                    self._connection.execute(CREATE_TABLE)
+                    self._connection.execute(CREATE_CHANGES)
+                    for trigger in CREATE_TRIGGERS:
+                        self._connection.execute(trigger)
+            self._seen_change = self._connection.execute(LAST_CHANGE).fetchone()[0]
+            self._own_changes.clear()
+            self._data_version = self._connection.execute("PRAGMA data_version").fetchone()[0]
+        return self.count()
+    
+    def reload_if_changed(self):
+        # Set when other processes changed more than the change log keeps
+        stale, self._stale = self._stale, False
+        return stale
+    
+    def read_external_changes(self):
+        with self._lock:
+            # data_version only changes on commits of other connections
+            data_version = self._connection.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return []
+            self._data_version = data_version
+            first = self._connection.execute(FIRST_CHANGE).fetchone()[0]
+            if first is not None and first > self._seen_change + 1:
+                self._stale = True
+                return None
+            rows = self._connection.execute(SELECT_CHANGES, (self._seen_change,)).fetchall()
+            changes = []
+            for seq, user_id, old_exists, old_consent, old_date, new_exists, new_consent, new_date in rows:
+                while self._own_changes and self._own_changes[0][1] < seq:
+                    self._own_changes.popleft()
+                if self._own_changes and self._own_changes[0][0] <= seq:
+                    continue
+                changes.append((
+                    user_id,
+                    (bool(old_consent), old_date) if old_exists else None,
+                    (bool(new_consent), new_date) if new_exists else None
+                ))
+            if rows:
+                self._seen_change = rows[-1][0]
+            return changes
+    
+    def watched_files(self):
+        # Commits of other processes land in the WAL file first
+        return [self.filename, f"{self.filename}-wal"]
+    
+    def get(self, user_id):
+        with self._lock:
+            row = self._connection.execute(SELECT_USER, (int(user_id),)).fetchone()
+        if row is None:
+            return None
+        return self._row_to_record(row)
+    
+    def put(self, user_id, record):
+        with self._lock, self._connection:
+            self._connection.execute(UPSERT_USER, self._record_to_row(user_id, record))
+            self._logged_own_changes(1)
+    
+    def put_many(self, items):
+        """Insert or replace many (user_id, record) pairs, return number of records"""
+        total = 0
+        batch = []
+        for user_id, record in items:
+            batch.append(self._record_to_row(user_id, record))
+            if len(batch) >= self.batch_size:
+                total += self._write_batch(batch)
+                batch = []
+        if batch:
+            total += self._write_batch(batch)
+        return total
+    
+    def delete(self, user_id):
+        with self._lock, self._connection:
+            cursor = self._connection.execute(DELETE_USER, (int(user_id),))
+            self._logged_own_changes(cursor.rowcount)
+        return cursor.rowcount > 0
+    
+    def delete_many(self, user_ids):
+        keys = [int(user_id) for user_id in user_ids]
+        removed = []
+        with self._lock, self._connection:
+            # Old records are needed by the caller, so they are read first in
+            # the same transaction (DELETE ... RETURNING needs SQLite 3.35)
+            for start in range(0, len(keys), SQL_VARIABLES_LIMIT):
+                chunk = keys[start:start + SQL_VARIABLES_LIMIT]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT user_id, consent_given, consent_date, last_updated, record FROM users "
+                    f"WHERE user_id IN ({placeholders})", chunk
+                ).fetchall()
+                removed.extend((str(row[0]), self._row_to_record(row[1:])) for row in rows)
+            self._connection.executemany(DELETE_USER, [(int(user_id),) for user_id, _ in removed])
+            self._logged_own_changes(len(removed))
+        return removed
+    
+    def user_ids(self):
+        with self._lock:
+            cursor = self._connection.execute(SELECT_IDS)
+            rows = cursor.fetchmany(self.batch_size)
+        while rows:
+            for (user_id,) in rows:
+                yield str(user_id)
+            with self._lock:
+                rows = cursor.fetchmany(self.batch_size)
+    
+    def items(self):
+        with self._lock:
+            cursor = self._connection.execute(SELECT_ALL)
+            rows = cursor.fetchmany(self.batch_size)
+        while rows:
+            for row in rows:
+                yield str(row[0]), self._row_to_record(row[1:])
+            with self._lock:
+                rows = cursor.fetchmany(self.batch_size)
+    
+    def consent_summary_chunks(self):
+        # A separate connection reads from a WAL snapshot taken by the first
+        # read, so writes made while the scan runs are not seen by it
+        connection = sqlite3.connect(self.filename, timeout=self.busy_timeout)
+        connection.execute("BEGIN")
+        last_change = connection.execute(LAST_CHANGE).fetchone()[0]
+        cursor = connection.execute(SELECT_SUMMARIES)
+        rows = cursor.fetchmany(self.batch_size)
+        with self._lock:
+            # Changes up to the snapshot are part of the scan
+            self._seen_change = last_change
+            while self._own_changes and self._own_changes[0][1] <= last_change:
+                self._own_changes.popleft()
+        
+        def scan(rows):
+            try:
+                while rows:
+                    for user_id, consent_given, consent_date in rows:
+                        yield user_id, bool(consent_given), consent_date
+                    rows = cursor.fetchmany(self.batch_size)
+            finally:
+                connection.close()
+        yield None, scan(rows)
+    
+    def count(self):
+        with self._lock:
+            return self._connection.execute(COUNT_USERS).fetchone()[0]
+    
+    def erase_deleted(self):
+        # Deleted rows stay in free pages of the database and in the WAL
+        # until the WAL is checkpointed and the database rebuilt
+        with self._lock:
+            self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._connection.execute("VACUUM")
+            self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+    
+    def _write_batch(self, batch):
+        with self._lock, self._connection:
+            self._connection.executemany(UPSERT_USER, batch)
+            self._logged_own_changes(len(batch))
+        return len(batch)
+    
+    def _logged_own_changes(self, count):
+        """Remember the user_changes entries of our own write (called in its transaction)
+
+        The caller already accounts for its own changes, so they are skipped
+        by read_external_changes. Nobody else writes inside our transaction,
+        so they are the last count entries.
+        """
+        if count <= 0:
+            return
+        last = self._connection.execute(LAST_CHANGE).fetchone()[0]
+        first = last - count + 1
+        if first == self._seen_change + 1:
+            self._seen_change = last
+        else:
+            self._own_changes.append((first, last))
+    
+    @staticmethod
+    def _record_to_row(user_id, record):
+        # Indexed fields get their own columns, the rest of the record
+        # (user data and any legacy fields) is kept as JSON
+        rest = {key: value for key, value in record.items() if key not in INDEXED_FIELDS}
+        return (
+            int(user_id),
+            1 if record.get("consent_given", False) else 0,
+            record.get("consent_date"),
+            record.get("last_updated"),
+            json.dumps(rest, ensure_ascii=False)
+        )
+    
+    @staticmethod
+    def _row_to_record(row):
+        consent_given, consent_date, last_updated, rest = row
+        record = {
+            "consent_given": bool(consent_given),
+            "consent_date": consent_date
+        }
+        record.update(json.loads(rest))
+        record["last_updated"] = last_updated
+        return record
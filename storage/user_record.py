@@ -0,0 +1,145 @@
+import sys
+from datetime import datetime, timedelta
+
+# Naive timestamps are stored as microseconds since this moment, without any
+# timezone conversion, so they convert back to exactly the same local time
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+class _Missing:
+    """Marks a field that is absent in the JSON layout (as opposed to null)"""
+    
+    __slots__ = ()
+    
+    def __repr__(self):
+        return "MISSING"
+
+MISSING = _Missing()
+
+RECORD_FIELDS = ("consent_given", "consent_date", "data", "last_updated")
+DATA_FIELDS = ("telegram_id", "name", "username", "phone")
+
+def timestamp_from_iso(value):
+    """Convert an ISO string to microseconds since EPOCH (other values are kept as they are)"""
+    if not isinstance(value, str):
+        return value
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if parsed.tzinfo is not None:
+        return value
+    return (parsed - EPOCH) // MICROSECOND
+
+def timestamp_to_iso(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return (EPOCH + timedelta(microseconds=value)).isoformat()
+    return value
+
+class UserRecord:
+    """Compact in-memory form of one user record
+
+    Used by the in-memory storages instead of the nested dicts of the JSON
+    layout: the user ID is an int, timestamps are ints, telegram_id is not
+    duplicated when it equals the user ID and names are interned. Records
+    are converted to and from the JSON layout only when they are read from
+    or written to files and when they are handed out by the storage.
+    Records are never modified in place, a change replaces the record.
+    """
+    
+    __slots__ = ("user_id", "consent_given", "consent_date", "last_updated",
+                 "telegram_id", "name", "username", "phone", "extra")
+    
+    def __init__(self, user_id, consent_given=False, consent_date=MISSING, last_updated=MISSING,
+                 telegram_id=MISSING, name=MISSING, username=MISSING, phone=MISSING, extra=None):
+        self.user_id = user_id
+        self.consent_given = consent_given
+        self.consent_date = consent_date
+        self.last_updated = last_updated
+        # True when telegram_id equals user_id
+        self.telegram_id = telegram_id
+        self.name = name
+        self.username = username
+        self.phone = phone
+        # Fields not known to this class: {"record": {...}, "data": {...}} or None
+        self.extra = extra
+    
+    @classmethod
+    def from_dict(cls, user_id, record):
+        """Build a record from the JSON layout"""
+        user_id = int(user_id)
+        data = record.get("data", MISSING)
+        extra = {}
+        
+        unknown = {key: value for key, value in record.items() if key not in RECORD_FIELDS}
+        if unknown:
+            extra["record"] = unknown
+        if isinstance(data, dict):
+            unknown = {key: value for key, value in data.items() if key not in DATA_FIELDS}
+            if unknown:
+                extra["data"] = unknown
+            telegram_id = data.get("telegram_id", MISSING)
+            if telegram_id == user_id and not isinstance(telegram_id, bool):
+                telegram_id = True
+            name = data.get("name", MISSING)
+            if isinstance(name, str):
+                name = sys.intern(name)
+            username = data.get("username", MISSING)
+            phone = data.get("phone", MISSING)
+        else:
+            if data is not MISSING:
+                extra.setdefault("record", {})["data"] = data
+            telegram_id = name = username = phone = MISSING
+        
+        return cls(
+            user_id,
+            consent_given=record.get("consent_given", MISSING),
+            consent_date=timestamp_from_iso(record.get("consent_date", MISSING)),
+            last_updated=timestamp_from_iso(record.get("last_updated", MISSING)),
+            telegram_id=telegram_id,
+            name=name,
+            username=username,
+            phone=phone,
+            extra=extra or None
+        )
+    
+    def to_dict(self):
+        """Convert the record to the JSON layout"""
+        record = {}
+        if self.consent_given is not MISSING:
+            record["consent_given"] = self.consent_given
+        if self.consent_date is not MISSING:
+            record["consent_date"] = timestamp_to_iso(self.consent_date)
+        
+        data = {}
+        if self.telegram_id is not MISSING:
+            data["telegram_id"] = self.user_id if self.telegram_id is True else self.telegram_id
+        for field in ("name", "username", "phone"):
+            value = getattr(self, field)
+            if value is not MISSING:
+                data[field] = value
+        if self.extra and "data" in self.extra:
+            data.update(self.extra["data"])
+        if data or self.telegram_id is not MISSING:
+            record["data"] = data
+        
+        if self.last_updated is not MISSING:
+            record["last_updated"] = timestamp_to_iso(self.last_updated)
+        if self.extra and "record" in self.extra:
+            record.update(self.extra["record"])
+        return record
+    
+    def has_consent(self):
+        return self.consent_given is not MISSING and bool(self.consent_given)
+    
+    def summary(self):
+        """(consent_given, consent day) as used by the consent index and statistics"""
+        return self.has_consent(), self.consent_day()
+    
+    def consent_day(self):
+        """Day of consent as YYYY-MM-DD or None"""
+        if self.consent_date is MISSING or self.consent_date is None:
+            return None
+        if isinstance(self.consent_date, int):
+            return (EPOCH + timedelta(microseconds=self.consent_date)).date().isoformat()
+        return str(self.consent_date)[:10]
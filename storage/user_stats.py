@@ -0,0 +1,40 @@
+from collections import Counter
+
+class UserStats:
+    """Running counters of the user base
+
+    Updated on every change instead of scanning the store, so reading them
+    is O(1). Signups are bucketed by the day of consent_date.
+    """
+    
+    def __init__(self):
+        self.total_users = 0
+        self.users_with_consent = 0
+        self.signups_by_day = Counter()
+    
+    def add(self, consent_given, consent_date):
+        """Count a record that appeared in the store"""
+        self.total_users += 1
+        if consent_given:
+            self.users_with_consent += 1
+            if consent_date:
+                self.signups_by_day[consent_date[:10]] += 1
+    
+    def remove(self, consent_given, consent_date):
+        """Count a record that disappeared from the store"""
+        self.total_users -= 1
+        if consent_given:
+            self.users_with_consent -= 1
+            if consent_date:
+                day = consent_date[:10]
+                self.signups_by_day[day] -= 1
+                if self.signups_by_day[day] <= 0:
+                    del self.signups_by_day[day]
+    
+    def as_dict(self):
+        return {
+            "total_users": self.total_users,
+            "users_with_consent": self.users_with_consent,
+            "consent_rate": (self.users_with_consent / self.total_users * 100) if self.total_users > 0 else 0,
+            "signups_by_day": dict(sorted(self.signups_by_day.items()))
+        }
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Modules live at the repository root, next to bot.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# config.py refuses to load without a token
+os.environ.setdefault("BOT_TOKEN", "123:test")
@@ -0,0 +1,24 @@
+import pytest
+from storage.atomic_file import write_atomic
+
+def test_write_atomic_replaces_the_file(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text("old")
+    write_atomic(str(path), "new")
+    assert path.read_text() == "new"
+    write_atomic(str(path), lambda f: f.write("streamed"), fsync=True)
+    assert path.read_text() == "streamed"
+    assert [p.name for p in tmp_path.iterdir()] == ["data.json"]
+
+def test_failed_write_keeps_the_old_file(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text("old")
+    
+    def fail(f):
+        f.write("half")
+        raise RuntimeError("disk full")
+    
+    with pytest.raises(RuntimeError):
+        write_atomic(str(path), fail)
+    assert path.read_text() == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["data.json"]
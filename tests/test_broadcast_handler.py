@@ -0,0 +1,50 @@
+import asyncio
+import json
+import pytest
+
+pytest.importorskip("telegram")
+from handlers.broadcast_handler import BroadcastHandler, BroadcastProgress
+
+class FakeDataManager:
+    def __init__(self, user_ids):
+        self.user_ids = user_ids
+    
+    def consented_user_ids(self, after=-1):
+        return iter([user_id for user_id in self.user_ids if user_id > after])
+    
+    def user_has_consent(self, user_id):
+        return True
+    
+    def consented_count(self):
+        return len(self.user_ids)
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0)
+        self.sent.append(chat_id)
+
+def test_only_one_process_resumes_a_broadcast(tmp_path):
+    checkpoint = tmp_path / "broadcast.json"
+    checkpoint.write_text(json.dumps(BroadcastProgress("hi", 0, 3).to_dict()))
+    data_manager = FakeDataManager([1, 2, 3])
+    # Two bot processes sharing the data directory
+    first = BroadcastHandler(data_manager, str(checkpoint), str(tmp_path / "blocked.txt"))
+    second = BroadcastHandler(data_manager, str(checkpoint), str(tmp_path / "blocked.txt"))
+    bot = FakeBot()
+    
+    async def run():
+        assert first.resume(bot)
+        assert not second.resume(bot)
+        await first._task
+        # Finished, so the lock is free again
+        assert not second.resume(bot)
+    
+    asyncio.run(run())
+    # The three users and the report to the admin chat
+    assert sorted(bot.sent) == [0, 1, 2, 3]
+    assert not checkpoint.exists()
+    assert second._run_lock.acquire(blocking=False)
+    second._run_lock.release()
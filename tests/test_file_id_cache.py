@@ -0,0 +1,44 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+
+telegram_error = pytest.importorskip("telegram.error")
+from file_id_cache import FileIdCache
+
+class FakeBot:
+    """Answers send_document like Telegram, rejecting cached file_ids with the given error"""
+    
+    def __init__(self, file_id_error=None):
+        self.file_id_error = file_id_error
+        self.uploads = 0
+    
+    async def send_document(self, chat_id, document, **kwargs):
+        if isinstance(document, str):
+            if self.file_id_error is not None:
+                raise telegram_error.BadRequest(self.file_id_error)
+        else:
+            self.uploads += 1
+        return SimpleNamespace(document=SimpleNamespace(file_id=f"id{self.uploads}", file_size=len(b"pdf")))
+
+def _cache_with_upload(tmp_path, bot):
+    document = tmp_path / "a.pdf"
+    document.write_bytes(b"pdf")
+    cache = FileIdCache(str(tmp_path / "file_ids.json"))
+    asyncio.run(cache.send_document(bot, 1, str(document)))
+    return cache, str(document)
+
+def test_rejected_file_id_is_uploaded_again(tmp_path):
+    bot = FakeBot()
+    cache, document = _cache_with_upload(tmp_path, bot)
+    bot.file_id_error = "Wrong file identifier/HTTP URL specified"
+    asyncio.run(cache.send_document(bot, 1, document))
+    assert bot.uploads == 2
+
+def test_other_errors_keep_the_file_id(tmp_path):
+    bot = FakeBot()
+    cache, document = _cache_with_upload(tmp_path, bot)
+    bot.file_id_error = "Chat not found"
+    with pytest.raises(telegram_error.BadRequest):
+        asyncio.run(cache.send_document(bot, 1, document))
+    assert bot.uploads == 1
+    assert asyncio.run(cache._current_file_id(document)) == "id1"
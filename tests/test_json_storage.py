@@ -0,0 +1,125 @@
+import multiprocessing
+from storage.json_storage import JsonStorage
+
+def _record(user_id):
+    return {
+        "consent_given": True,
+        "consent_date": "2024-05-01T10:00:00",
+        "data": {"telegram_id": user_id, "first_name": f"user{user_id}"},
+        "last_updated": "2024-05-01T10:00:00"
+    }
+
+def _sync(storage):
+    """What UserDataManager.check_and_reload does on a watcher event"""
+    if storage.read_external_changes() is None:
+        storage.reload_if_changed()
+
+def _open(path, compact_threshold=10):
+    storage = JsonStorage(str(path), mode="journal", compact_threshold=compact_threshold)
+    storage.load()
+    return storage
+
+def test_journal_is_replayed_on_load(tmp_path):
+    path = tmp_path / "users.json"
+    storage = _open(path, compact_threshold=1000)
+    for user_id in range(1, 6):
+        storage.put(str(user_id), _record(user_id))
+    storage.delete("3")
+    storage.close()
+    assert not path.exists()
+    
+    reloaded = _open(path)
+    assert sorted(int(user_id) for user_id in reloaded.user_ids()) == [1, 2, 4, 5]
+    assert reloaded.get("2") == _record(2)
+    reloaded.close()
+
+def test_follower_picks_up_entries_of_another_writer(tmp_path):
+    path = tmp_path / "users.json"
+    reader = _open(path, compact_threshold=1000)
+    writer = _open(path, compact_threshold=1000)
+    writer.put("1", _record(1))
+    writer.put("2", _record(2))
+    
+    changes = reader.read_external_changes()
+    assert [user_id for user_id, _, _ in changes] == [1, 2]
+    assert reader.count() == 2
+    reader.close()
+    writer.close()
+
+def test_follower_reloads_after_missing_a_journal_generation(tmp_path):
+    path = tmp_path / "users.json"
+    reader = _open(path)
+    writer = _open(path)
+    reader.put("1", _record(1))
+    assert reader.read_external_changes() == []
+    # Two compactions while the reader is not looking, then a few more entries
+    for user_id in range(100, 120):
+        writer.put(str(user_id), _record(user_id))
+        writer._wait_for_compaction()
+    for user_id in range(200, 203):
+        writer.put(str(user_id), _record(user_id))
+    
+    assert reader.read_external_changes() is None
+    assert reader.reload_if_changed()
+    assert reader.count() == 24
+    writer.close()
+    reader.close()
+
+def _writer(path, worker, rounds, go, done):
+    storage = _open(path)
+    for round_number in range(rounds):
+        if not go.wait(timeout=30):
+            break
+        go.clear()
+        # Two compactions (journal rotations) and a few more entries per round
+        for i in range(23):
+            user_id = worker * 100000 + round_number * 100 + i
+            storage.put(str(user_id), _record(user_id))
+            storage._wait_for_compaction()
+        done.set()
+    storage.close()
+
+def test_reader_process_keeps_up_with_writer_processes(tmp_path):
+    path = str(tmp_path / "users.json")
+    workers, rounds = 2, 5
+    reader = _open(path)
+    context = multiprocessing.get_context("fork")
+    signals = [(context.Event(), context.Event()) for _ in range(workers)]
+    processes = [context.Process(target=_writer, args=(path, worker, rounds, go, done), daemon=True)
+                 for worker, (go, done) in enumerate(signals)]
+    for process in processes:
+        process.start()
+    for round_number in range(rounds):
+        for go, done in signals:
+            go.set()
+        for go, done in signals:
+            assert done.wait(timeout=30)
+            done.clear()
+        # What the file watcher does after the writers' bursts
+        _sync(reader)
+        assert reader.count() == workers * 23 * (round_number + 1)
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+    
+    on_disk = _open(path)
+    assert set(reader.user_ids()) == set(on_disk.user_ids())
+    on_disk.close()
+    reader.close()
+
+def test_erase_deleted_removes_records_from_the_files(tmp_path):
+    path = tmp_path / "users.json"
+    storage = _open(path, compact_threshold=1000)
+    for user_id in range(1, 4):
+        storage.put(str(user_id), _record(user_id))
+    storage.save()
+    storage.put("2", _record(2))
+    storage.delete_many(["2"])
+    storage.erase_deleted()
+    storage.close()
+    
+    for name in ("users.json", "users.json.journal"):
+        assert b"user2" not in (tmp_path / name).read_bytes()
+    reloaded = _open(path)
+    assert sorted(reloaded.user_ids()) == ["1", "3"]
+    reloaded.close()
@@ -0,0 +1,81 @@
+import random
+import string
+import time
+import pytest
+from keyword_matcher import StemMatcher, create_matcher, edit_distance
+
+MAPPING = {
+    "аудит": "audit_processes.pdf",
+    "процессы": "audit_processes.pdf",
+    "продукт": "audit_product.pdf",
+    "продукта": "audit_product.pdf",
+    "первый": "frst_file.pdf",
+    "файл": "frst_file.pdf",
+    "audit": "audit_processes.pdf",
+    "processes": "audit_processes.pdf",
+    "product": "audit_product.pdf",
+    "first": "frst_file.pdf",
+    "file": "frst_file.pdf"
+}
+
+@pytest.mark.parametrize("text, expected", [
+    ("аудит", ["audit_processes.pdf"]),
+    ("аудита", ["audit_processes.pdf"]),
+    ("первого", ["frst_file.pdf"]),
+    ("файлы", ["frst_file.pdf"]),
+    ("products", ["audit_product.pdf"]),
+    ("Нужен аудит, первый файл", ["audit_processes.pdf", "frst_file.pdf"]),
+])
+def test_stem_matches_word_forms(text, expected):
+    assert StemMatcher(MAPPING).match(text) == expected
+
+@pytest.mark.parametrize("text", ["аудио", "ауди", "перва", "перв"])
+def test_stem_ignores_shorter_words_with_the_same_stem(text):
+    assert StemMatcher(MAPPING).match(text) == []
+
+def test_fuzzy_matching_is_off_by_default():
+    assert not create_matcher(MAPPING, {"mode": "stem"}).fuzzy
+    assert create_matcher(MAPPING, {"mode": "stem"}).match("процесы") == []
+
+def test_transposed_letters_are_one_typo():
+    assert edit_distance("procesess", "processes") == 1
+    assert edit_distance("kitten", "sitting") == 3
+
+@pytest.mark.parametrize("text, expected", [
+    ("процесы", ["audit_processes.pdf"]),
+    ("procesess", ["audit_processes.pdf"]),
+    ("продуктт", ["audit_product.pdf"]),
+])
+def test_fuzzy_matches_misspelled_keywords(text, expected):
+    assert StemMatcher(MAPPING, fuzzy=True).match(text) == expected
+
+@pytest.mark.parametrize("text", [
+    "fine", "five", "fill", "film", "mile", "fire", "fist", "audio",
+    "прогресс", "профессия", "процессор", "progress",
+])
+def test_fuzzy_ignores_ordinary_words(text):
+    assert StemMatcher(MAPPING, fuzzy=True).match(text) == []
+
+def _random_word(rng, letters, shortest):
+    return "".join(rng.choice(letters) for _ in range(rng.randint(shortest, 12)))
+
+def test_fuzzy_matching_p99_latency_with_10k_keywords():
+    rng = random.Random(14)
+    letters = string.ascii_lowercase + "абвгдежзиклмнопрстуфхцчшщыэюя"
+    keywords = list(dict.fromkeys(_random_word(rng, letters, 6) for _ in range(10000)))
+    matcher = StemMatcher({keyword: f"{keyword}.pdf" for keyword in keywords}, fuzzy=True)
+    latencies = []
+    for _ in range(500):
+        # Ten words without a match and one keyword with a typo
+        keyword = rng.choice(keywords)
+        position = rng.randrange(len(keyword))
+        misspelled = keyword[:position] + rng.choice(letters) + keyword[position + 1:]
+        words = [_random_word(rng, letters, 3) for _ in range(10)] + [misspelled]
+        matcher._fuzzy_cache.clear()
+        started = time.perf_counter()
+        found = matcher.match(" ".join(words))
+        latencies.append(time.perf_counter() - started)
+        assert f"{keyword}.pdf" in found
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)]
+    assert p99 < 0.010, f"p99 {p99 * 1000:.1f} ms"
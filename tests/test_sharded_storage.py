@@ -0,0 +1,40 @@
+from storage.sharded_storage import ShardedStorage
+
+def _record(user_id, consent_given=True):
+    return {
+        "consent_given": consent_given,
+        "consent_date": "2024-05-01T10:00:00",
+        "data": {"telegram_id": user_id},
+        "last_updated": "2024-05-01T10:00:00"
+    }
+
+def _open(path):
+    storage = ShardedStorage(str(path), shards=8, max_records_in_memory=50)
+    storage.load()
+    return storage
+
+def test_summary_scan_does_not_keep_shards_loaded(tmp_path):
+    storage = _open(tmp_path)
+    for user_id in range(200):
+        storage.put(str(user_id), _record(user_id, consent_given=user_id % 2 == 0))
+    storage.close()
+    
+    storage = _open(tmp_path)
+    summaries = [summary for _, chunk in storage.consent_summary_chunks() for summary in chunk]
+    assert sorted(user_id for user_id, consent_given, _ in summaries if consent_given) == list(range(0, 200, 2))
+    assert storage.loaded_shards() == []
+    storage.close()
+
+def test_edits_of_scanned_shards_are_noticed(tmp_path):
+    storage = _open(tmp_path)
+    storage.put("1", _record(1))
+    storage.close()
+    
+    reader = _open(tmp_path)
+    list(reader.consent_summary_chunks())
+    assert not reader.reload_if_changed()
+    writer = _open(tmp_path)
+    writer.put("2", _record(2))
+    writer.close()
+    assert reader.reload_if_changed()
+    reader.close()
@@ -0,0 +1,63 @@
+import logging
+from collections import deque
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+def _user_key(update):
+    """User (or chat) whose updates must stay in order, None if there is none"""
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different users concurrently, each user's in order
+
+    Up to max_concurrent_updates updates run at once. An update from a user
+    whose previous update is still running is queued behind it and run by
+    the same task afterwards, so flows like consent -> contact share keep
+    their order and a waiting update does not take a slot from other users.
+    """
+    
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # User -> updates waiting for the one being processed
+        self._queues = {}
+    
+    async def do_process_update(self, update, coroutine):
+        key = _user_key(update)
+        if key is None:
+            await coroutine
+            return
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(coroutine)
+            return
+        self._queues[key] = queue = deque()
+        try:
+            await self._run(coroutine)
+            while queue:
+                await self._run(queue.popleft())
+        finally:
+            del self._queues[key]
+            # Only left over when cancelled on shutdown
+            for pending in queue:
+                pending.close()
+    
+    @staticmethod
+    async def _run(coroutine):
+        # Handler errors are reported by the Application, this only keeps the queue going
+        try:
+            await coroutine
+        except Exception as e:
+            logger.error(f"Error processing update: {e}")
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass